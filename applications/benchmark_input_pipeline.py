@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import os
+import time
+
+import tensorflow as tf
+
+from pose_3d import benchmark
+from pose_3d import dataset_manifest
+from pose_3d.data_helpers import dataset_from_filenames_surreal
+from pose_3d.pipeline_stats import reader_times
+from pose_3d.synthetic_surreal import write_synthetic_dataset
+
+
+# Size of the synthetic dataset written if the directory does not exist
+N_DIRS = 4
+CLIPS_PER_DIR = 4
+FRAMES_PER_CLIP = 50
+COMPACT_MAPS = True      # maps as written by compact_maps.py
+FRAMES_FORMAT = 'both'   # 'jpg', 'mp4' or 'both' - both are benchmarked
+BATCH_SIZE = 32
+N_WARMUP_BATCHES = 5
+MAX_SECONDS = 120
+
+
+def time_pipeline(maps_files, info_files, frames_paths, compact):
+    """ Examples/s through the dataset as train() batches it, without the
+    model. Stops after one pass or MAX_SECONDS """
+    too_small = ("Dataset smaller than warmup + 1 batches ({} examples): "
+                 "use more clips or frames".format(
+                     (N_WARMUP_BATCHES + 1) * BATCH_SIZE))
+    graph = tf.Graph()
+    with graph.as_default():
+        dataset = dataset_from_filenames_surreal(
+            maps_files, info_files, frames_paths, compact=compact)
+        dataset = dataset.batch(BATCH_SIZE).prefetch(16)
+        next_batch = dataset.make_one_shot_iterator().get_next()
+        # Only fetch a scalar so the time is not spent copying batches out
+        batch_len = tf.shape(next_batch[0])[0]
+        with tf.Session() as sess:
+            start = time.perf_counter()
+            try:
+                for _ in range(N_WARMUP_BATCHES):
+                    sess.run(batch_len)
+            except tf.errors.OutOfRangeError:
+                raise ValueError(too_small)
+            first_batches_secs = time.perf_counter() - start
+            reader_times.reset()
+            n_examples = 0
+            secs = []
+            start = time.perf_counter()
+            while time.perf_counter() - start < MAX_SECONDS:
+                batch_start = time.perf_counter()
+                try:
+                    n_examples += sess.run(batch_len)
+                except tf.errors.OutOfRangeError:
+                    break
+                secs.append(time.perf_counter() - batch_start)
+            total_secs = time.perf_counter() - start
+    if not secs:
+        raise ValueError(too_small)
+    calls, read_examples, read_secs, _ = reader_times.pop()
+    result = benchmark.summarise_times(secs)
+    result.update({
+        'examples_per_sec': n_examples / total_secs,
+        'warmup_batches_secs': first_batches_secs,
+        'reader_ms_per_example': (1000 * read_secs / read_examples
+                                  if read_examples else None)})
+    return result
+
+
+def main(data_dir, out_path, baseline_path=None):
+    if not os.path.isdir(data_dir):
+        print("Writing synthetic dataset to {}".format(data_dir))
+        write_synthetic_dataset(data_dir, N_DIRS, CLIPS_PER_DIR,
+                                FRAMES_PER_CLIP, compact=COMPACT_MAPS,
+                                frames_format=FRAMES_FORMAT)
+    clips = dataset_manifest.manifest_clips(
+        dataset_manifest.load_manifest(data_dir))
+    maps_files, info_files, _ = dataset_manifest.clip_files(clips)
+    clip_bases = [ f[:-len('_maps.mat')] for f in maps_files ]
+    frames_dirs = [ base + '_frames' for base in clip_bases ]
+    videos = [ base + '.mp4' for base in clip_bases ]
+
+    sources = []
+    if all(os.path.isdir(d) for d in frames_dirs):
+        sources.append(('frames', frames_dirs))
+    if all(os.path.isfile(v) for v in videos):
+        sources.append(('video', videos))
+
+    results = []
+    for source, frames_paths in sources:
+        for compact in (False, True):
+            params = {'frames': source, 'compact': compact,
+                      'batch_size': BATCH_SIZE, 'n_clips': len(clips),
+                      'frames_per_clip': FRAMES_PER_CLIP}
+            try:
+                result = time_pipeline(maps_files, info_files, frames_paths,
+                                       compact)
+            except ValueError as e:
+                print(e)
+                return 1
+            results.append(dict(name='dataset_from_filenames_surreal',
+                                params=params, **result))
+            print("{:60} {:8.1f} ex/s".format(
+                str(params), result['examples_per_sec']), flush=True)
+
+    benchmark.write_results(out_path, results)
+
+    if baseline_path is not None:
+        print("\nCompared to {} (ratio > 1 is slower)".format(baseline_path))
+        for _, params, old_ms, new_ms, ratio in benchmark.compare_results(
+                baseline_path, results):
+            print("{:60} {:9.2f} -> {:9.2f} ms/batch  x{:.2f}".format(
+                str(params), old_ms, new_ms, ratio))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python3 benchmark_input_pipeline.py <data-dir> "
+              "<results.json> [<baseline-results.json>]\n"
+              "A synthetic dataset is written to <data-dir> if it does not "
+              "exist")
+        sys.exit()
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+
+import tensorflow as tf
+import numpy as np
+
+from pose_3d import benchmark
+from pose_3d import config
+from pose_3d import utils
+from pose_3d.network import build_model
+
+
+BATCH_SIZES = [1, 8, 32]
+RESOLUTIONS = [(120, 160), (240, 320), (480, 640)]  # (height, width)
+# build_model is much slower, so fewer configurations
+MODEL_BATCH_SIZES = [1, 8]
+MODEL_RESOLUTIONS = [(240, 320)]
+# Same number of vertices as the SMPL mesh (6890)
+MESH_GRID = (106, 65)
+ITERS = 20
+# Max absolute difference of utils.gaussian_blur from the 2-D reference
+BLUR_TOLERANCE = 1e-5
+BLUR_DOWNSAMPLE = 2
+
+
+def run_graph(build_fn, iters=ITERS):
+    """ Build the op in a new graph with build_fn, initialise the synthetic
+    inputs and time it """
+    graph = tf.Graph()
+    with graph.as_default():
+        fetches = build_fn()
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            return benchmark.time_run(sess, fetches, iters=iters)
+
+
+def gaussian_blur_2d(img, kernel_size=13, sigma=7):
+    """ Reference blur with the full 2-D kernel, as gaussian_blur was before
+    it was made separable """
+    kernel = utils.gaussian_kernel_1d(kernel_size, sigma)
+    kernel = np.outer(kernel, kernel)
+    kernel = np.tile(kernel[:, :, np.newaxis, np.newaxis],
+                     [1, 1, img.shape[-1].value, 1])
+    return tf.nn.depthwise_conv2d_native(img, tf.constant(kernel),
+                                         [1, 1, 1, 1], padding='SAME',
+                                         data_format='NHWC')
+
+
+def blur_max_diffs():
+    """ Max absolute difference of the separable and downsampled blurs from
+    the 2-D reference, on heatmap-like inputs """
+    graph = tf.Graph()
+    with graph.as_default():
+        heatmaps = benchmark.random_variable(
+            [1, 240, 320, config.n_joints]) ** 8  # mostly small, some peaks
+        reference = gaussian_blur_2d(heatmaps)
+        separable = utils.gaussian_blur(heatmaps)
+        downsampled = utils.gaussian_blur(heatmaps,
+                                          downsample=BLUR_DOWNSAMPLE)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            return sess.run(
+                (tf.reduce_max(tf.abs(separable - reference)),
+                 tf.reduce_max(tf.abs(downsampled - reference))))
+
+
+def heatmap_benchmarks():
+    for batch_size in BATCH_SIZES:
+        for height, width in RESOLUTIONS:
+            shape = [batch_size, height, width, config.n_joints]
+            params = {'batch_size': batch_size, 'height': height,
+                      'width': width}
+            yield 'soft_argmax_rescaled', params, lambda: (
+                utils.soft_argmax_rescaled(benchmark.random_variable(shape)))
+            yield 'gaussian_blur', params, lambda: (
+                utils.gaussian_blur(benchmark.random_variable(shape)))
+            yield 'gaussian_blur_2d_reference', params, lambda: (
+                gaussian_blur_2d(benchmark.random_variable(shape)))
+            yield 'gaussian_blur_downsampled', params, lambda: (
+                utils.gaussian_blur(benchmark.random_variable(shape),
+                                    downsample=BLUR_DOWNSAMPLE))
+
+
+def mesh_benchmarks():
+    vertices, faces = benchmark.grid_mesh(*MESH_GRID)
+    vertex_faces = utils.vertex_faces_from_face_verts(faces)
+    for batch_size in BATCH_SIZES:
+        params = {'batch_size': batch_size, 'n_vertices': len(vertices)}
+
+        def normals():
+            batch_vertices = tf.Variable(
+                np.tile(vertices, [batch_size, 1, 1]), trainable=False)
+            noise = benchmark.random_variable(batch_vertices.shape, -0.01,
+                                              0.01)
+            return utils.normals_from_mesh(batch_vertices + noise,
+                                           tf.constant(faces),
+                                           tf.constant(vertex_faces))
+        yield 'normals_from_mesh', params, normals
+
+
+def rotation_benchmarks():
+    for batch_size in BATCH_SIZES:
+        params = {'batch_size': batch_size}
+        yield 'rotate_global_pose', params, lambda: utils.rotate_global_pose(
+            benchmark.random_variable([batch_size, 72], -np.pi, np.pi),
+            benchmark.random_variable([batch_size], -np.pi, np.pi, seed=1))
+        yield 'add_axis_angle_rotations', params, lambda: (
+            utils.add_axis_angle_rotations(
+                benchmark.random_variable([batch_size, 3], -np.pi, np.pi),
+                benchmark.random_variable([batch_size, 3], -np.pi, np.pi,
+                                          seed=1)))
+
+
+def model_benchmarks():
+    for batch_size in MODEL_BATCH_SIZES:
+        for height, width in MODEL_RESOLUTIONS:
+            shape = [batch_size, height, width, 3 + config.n_joints]
+            params = {'batch_size': batch_size, 'height': height,
+                      'width': width}
+
+            def forward():
+                return build_model(benchmark.random_variable(shape),
+                                   training=False)
+
+            def forward_backward():
+                outputs = build_model(benchmark.random_variable(shape),
+                                      training=True)
+                loss = tf.reduce_mean(tf.square(outputs))
+                update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+                grads = tf.gradients(loss, tf.trainable_variables())
+                return tf.group(*(grads + update_ops))
+
+            yield 'build_model_forward', params, forward
+            yield 'build_model_forward_backward', params, forward_backward
+
+
+def main(out_path, baseline_path=None):
+    separable_diff, downsampled_diff = blur_max_diffs()
+    print("gaussian_blur max diff from 2-D {:.2e} (downsampled x{} {:.2e})"
+          .format(separable_diff, BLUR_DOWNSAMPLE, downsampled_diff))
+    if separable_diff > BLUR_TOLERANCE:
+        print("gaussian_blur differs from the 2-D reference")
+        return 1
+
+    results = []
+
+    def record(name, params, timing):
+        results.append(dict(name=name, params=params, **timing))
+        print("{:30} {:50} {:9.2f} ms".format(
+            name, str(params), timing['mean_ms']), flush=True)
+
+    for benchmarks in (heatmap_benchmarks(), mesh_benchmarks(),
+                       rotation_benchmarks(), model_benchmarks()):
+        for name, params, build_fn in benchmarks:
+            record(name, params, run_graph(build_fn))
+
+    _, faces = benchmark.grid_mesh(*MESH_GRID)
+    record('vertex_faces_from_face_verts', {'n_faces': len(faces)},
+           benchmark.time_call(utils.vertex_faces_from_face_verts, faces))
+
+    benchmark.write_results(out_path, results)
+
+    if baseline_path is not None:
+        print("\nCompared to {} (ratio > 1 is slower)".format(baseline_path))
+        for name, params, old_ms, new_ms, ratio in benchmark.compare_results(
+                baseline_path, results):
+            print("{:30} {:50} {:9.2f} -> {:9.2f} ms  x{:.2f}".format(
+                name, str(params), old_ms, new_ms, ratio))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 benchmark_ops.py <results.json> "
+              "[<baseline-results.json>]")
+        sys.exit()
+    sys.exit(main(*sys.argv[1:]))
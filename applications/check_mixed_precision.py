@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import os
+import time
+
+import tensorflow as tf
+import numpy as np
+
+from pose_3d.pose_model_3d import PoseModel3d
+from pose_3d.data_helpers import read_maps_poses_images_surreal
+from pose_3d import config
+from pose_3d import dataset_manifest
+
+
+DATASET_PATH = '/mnt/Data/ben/surreal/SURREAL/data/cmu/train/run0/'
+SUMMARY_DIR = '/tmp/tf_logs/3d_pose_mixed_precision'
+SAVER_PATH = '/home/ben/tensorflow_logs/3d_pose/ckpts/3d_pose.ckpt'
+BATCH_SIZE = 32
+N_TIMED_RUNS = 10
+# Max absolute difference from float32 for the outputs to be accepted
+TOLERANCE = {'float16': 5e-2, 'bfloat16': 2e-1}
+
+
+def fixed_batch():
+    """ The first BATCH_SIZE usable frames of the dataset, in manifest order
+    so every run compares on the same inputs """
+    clips = dataset_manifest.manifest_clips(
+        dataset_manifest.load_manifest(DATASET_PATH, refresh=False))
+    batch = []
+    for clip in clips:
+        inputs, *_ = read_maps_poses_images_surreal(
+            clip['maps_file'], clip['info_file'], clip['frames_path'])
+        batch.extend(inputs[:BATCH_SIZE - len(batch)])
+        if len(batch) == BATCH_SIZE:
+            return np.array(batch)
+    raise ValueError("Fewer than {} usable frames".format(BATCH_SIZE))
+
+
+def run(inputs, compute_dtype):
+    pm_3d = PoseModel3d((None, 240, 320, 3 + config.n_joints),
+                        tf.Graph(),
+                        mode='test',
+                        summary_dir=SUMMARY_DIR,
+                        saver_path=SAVER_PATH,
+                        restore_model=True,
+                        compute_dtype=compute_dtype)
+    outputs = pm_3d.estimate(inputs)  # also restores
+    start = time.time()
+    for _ in range(N_TIMED_RUNS):
+        pm_3d.estimate(inputs)
+    return outputs, (time.time() - start) / N_TIMED_RUNS
+
+
+def main(dtype_name):
+    if tf.train.latest_checkpoint(os.path.dirname(SAVER_PATH)) is None:
+        # Both models would be compared with different random weights
+        print("No checkpoint in {}".format(os.path.dirname(SAVER_PATH)))
+        return 1
+    inputs = fixed_batch()
+    out_32, time_32 = run(inputs, tf.float32)
+    out_mixed, time_mixed = run(inputs, tf.as_dtype(dtype_name))
+
+    diff = np.abs(out_mixed - out_32)
+    print("pose max diff {:.2e} mean {:.2e}".format(
+        diff[:, :72].max(), diff[:, :72].mean()))
+    print("camera max diff {:.2e} mean {:.2e}".format(
+        diff[:, 72:].max(), diff[:, 72:].mean()))
+    print("float32 {:.1f} ex/s, {} {:.1f} ex/s".format(
+        BATCH_SIZE / time_32, dtype_name, BATCH_SIZE / time_mixed))
+    ok = np.all(np.isfinite(out_mixed)) and diff.max() < TOLERANCE[dtype_name]
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in TOLERANCE:
+        print("Usage: python3 check_mixed_precision.py <float16|bfloat16>")
+        sys.exit()
+    sys.exit(main(sys.argv[1]))
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import os
+import multiprocessing
+
+import scipy.io
+
+from pose_3d import config
+from pose_3d import dataset_manifest
+from pose_3d.data_helpers import quantize_heatmaps
+from pose_3d.job_manifest import JobManifest
+
+
+DATASET_PATH = '/mnt/Data/ben/surreal/SURREAL/data/cmu/train/run0/'
+# Manifest written by predict_surreal_videos.py, updated for rewritten files
+MANIFEST_PATH = os.path.join(DATASET_PATH, '..', 'heatmaps_manifest.json')
+N_WORKERS = os.cpu_count()
+KEEP_KEYS = ['mask', 'diffs', 'detected_2D', 'visibility_2D']
+
+
+def compact_maps(maps_file):
+    """ Drop the PAFs and the eye, ear and background heatmap channels, and
+    store the heatmaps as uint8. Returns the file sizes before and after """
+    size_before = os.path.getsize(maps_file)
+    # Only reads the headers, so reruns don't decompress compacted files
+    names = [ name for name, _, _ in scipy.io.whosmat(maps_file) ]
+    assert 'heat_mat' in names
+    if 'heat_mat_range' in names:  # already compacted
+        return maps_file, size_before, size_before
+    # Skips decompressing the PAFs
+    maps_dict = scipy.io.loadmat(maps_file,
+                                 variable_names=KEEP_KEYS + ['heat_mat'])
+    # heat_mat: height, width, channels, time
+    assert maps_dict['heat_mat'].shape[0] == 240
+    for key in KEEP_KEYS:
+        assert key in maps_dict
+    out_dict = {key: maps_dict[key] for key in KEEP_KEYS}
+    heat_mat = maps_dict['heat_mat'][:, :, :config.n_joints, :]
+    out_dict['heat_mat'], out_dict['heat_mat_range'] = (
+        quantize_heatmaps(heat_mat))
+
+    # Write next to the original and rename over it, so a crash never
+    # leaves a partially written maps file
+    tmp_file = maps_file[:-len('.mat')] + '_tmp.mat'
+    scipy.io.savemat(tmp_file, out_dict, do_compression=True)
+    os.replace(tmp_file, maps_file)
+    return maps_file, size_before, os.path.getsize(maps_file)
+
+
+if __name__ == '__main__':
+    clips = dataset_manifest.manifest_clips(
+        dataset_manifest.load_manifest(DATASET_PATH, n_workers=N_WORKERS))
+    maps_files, _, _ = dataset_manifest.clip_files(clips)
+
+    manifest = None
+    if os.path.exists(MANIFEST_PATH):
+        manifest = JobManifest(os.path.realpath(MANIFEST_PATH))
+
+    total_before, total_after = 0, 0
+    compacted = []
+    with multiprocessing.Pool(N_WORKERS) as pool:
+        for maps_file, size_before, size_after in pool.imap_unordered(
+                compact_maps, maps_files):
+            print("{} {:.1f}MB -> {:.1f}MB".format(
+                maps_file, size_before / 2**20, size_after / 2**20),
+                file=sys.stderr)
+            total_before += size_before
+            total_after += size_after
+            if size_after != size_before:
+                compacted.append(maps_file)
+            if manifest is not None and len(compacted) >= 100:
+                manifest.update_outputs(compacted)
+                compacted = []
+    if manifest is not None and compacted:
+        manifest.update_outputs(compacted)
+    print("Total {:.1f}GB -> {:.1f}GB".format(
+        total_before / 2**30, total_after / 2**30))
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import os
+
+from pose_3d import data_helpers
+from pose_3d import dataset_manifest
+from pose_3d.surreal_shards import ShardWriter
+
+
+DATASET_PATH = '/mnt/Data/ben/surreal/SURREAL/data/cmu/train/run0/'
+# Written by validate_data.py - clips listed in it are excluded
+BAD_FILES_REPORT = os.path.join(DATASET_PATH, 'bad_files.json')
+FRAMES_PER_SHARD = 1000
+
+
+def main(out_dir):
+    clips = dataset_manifest.manifest_clips(
+        dataset_manifest.load_manifest(DATASET_PATH),
+        exclude=data_helpers.load_bad_files(BAD_FILES_REPORT))
+    maps_files, info_files, frames_paths = dataset_manifest.clip_files(clips)
+
+    # Frame counts from the manifest size the shards up front
+    writer = ShardWriter(out_dir, maps_files,
+                         [ clip['n_frames'] for clip in clips ],
+                         frames_per_shard=FRAMES_PER_SHARD)
+    for clip_idx, files in enumerate(
+            zip(maps_files, info_files, frames_paths)):
+        maps_file, info_file, frames_path = files
+        print(maps_file)
+        try:
+            heatmaps, mask = data_helpers.load_maps_surreal(maps_file)
+            poses, shapes, joints2d, zrot = data_helpers.load_info_surreal(
+                info_file, heatmaps.shape[2])
+            frames = data_helpers.load_frames_surreal(frames_path)
+            writer.write_clip(clip_idx, heatmaps, frames, poses, shapes,
+                              joints2d, zrot, mask)
+        except (ValueError, OSError) as e:
+            # Clip is left with an empty mask so it is never read
+            print("Skipping {}: {}".format(maps_file, e), file=sys.stderr)
+    writer.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 convert_surreal_to_shards.py <output-dir>")
+        sys.exit()
+    sys.exit(main(os.path.realpath(sys.argv[1])))
@@ -4,42 +4,31 @@
 import __init__
 
 import os
-import glob
 
 import tensorflow as tf
 import numpy as np
 
 from pose_3d.pose_model_3d import PoseModel3d
 from pose_3d.data_helpers import dataset_from_filenames_surreal
+from pose_3d.data_helpers import load_bad_files
 from pose_3d import config
+from pose_3d import dataset_manifest
 
 DATASET_PATH = '/mnt/Data/ben/surreal/SURREAL/data/cmu/train/run0/'
 SUMMARY_DIR = '/home/ben/tensorflow_logs/3d_pose'
 SAVER_PATH = '/home/ben/tensorflow_logs/3d_pose/ckpts/3d_pose.ckpt'
+# Written by validate_data.py - clips listed in it are excluded
+BAD_FILES_REPORT = os.path.join(DATASET_PATH, 'bad_files.json')
 
 if __name__ == '__main__':
-    dataset_dir = os.path.realpath(DATASET_PATH)
-    basenames = sorted(os.listdir(dataset_dir))
-
     smpl_path = os.path.join(
         __init__.project_path, 'data', 'SMPL_model', 'models_numpy')
     smpl_neutral = os.path.join(smpl_path, 'model_neutral_np.pkl')
 
-    maps_files = []
-    info_files = []
-    frames_paths = []
-    for basename in basenames:
-        one_data_dir = os.path.join(dataset_dir, basename)
-        one_dir_maps_files = glob.glob(
-            os.path.join(one_data_dir, basename + '_c*_maps.mat'))
-        # only get the info file and frames for heatmaps that exist
-        one_dir_info_files = map(lambda f: f[:-len('_maps.mat')] + '_info.mat',
-                                 one_dir_maps_files)
-        one_dir_frames_paths = map(lambda f: f[:-len('_maps.mat')] + '_frames',
-                                   one_dir_maps_files)
-        maps_files.extend(one_dir_maps_files)
-        info_files.extend(one_dir_info_files)
-        frames_paths.extend(one_dir_frames_paths)
+    manifest = dataset_manifest.load_manifest(DATASET_PATH)
+    clips = dataset_manifest.manifest_clips(
+        manifest, exclude=load_bad_files(BAD_FILES_REPORT))
+    maps_files, info_files, frames_paths = dataset_manifest.clip_files(clips)
 
     graph = tf.Graph()
     with graph.as_default():
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+
+import tensorflow as tf
+import numpy as np
+
+from pose_3d.pose_model_3d import PoseModel3d
+from pose_3d.export import FrozenPoseModel, op_counts, FUSED_BATCH_NORM_OPS
+from pose_3d import benchmark
+from pose_3d import config
+
+
+SAVER_PATH = '/home/ben/tensorflow_logs/3d_pose/ckpts/3d_pose.ckpt'
+SUMMARY_DIR = '/tmp/tf_logs/3d_pose_export'
+BATCH_SIZES = [1, 8]
+ITERS = 20
+TOLERANCE = 1e-3  # max absolute output difference from the original graph
+# Op types whose counts are printed before and after export
+SHOWN_OPS = ['FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3', 'Mul',
+             'Add', 'CheckNumerics', 'Identity', 'Exp', 'Const']
+
+
+def main(out_path):
+    pm_3d = PoseModel3d((None, 240, 320, 3 + config.n_joints),
+                        tf.Graph(),
+                        mode='test',
+                        summary_dir=SUMMARY_DIR,
+                        saver_path=SAVER_PATH,
+                        restore_model=True)
+    frozen_def = pm_3d.export_inference_graph(out_path)
+    frozen = FrozenPoseModel(out_path)
+    print("Exported to {}".format(out_path))
+
+    before = op_counts(pm_3d.graph.as_graph_def())
+    after = op_counts(frozen_def)
+    print("{:16} {:>8} {:>8}".format('op', 'before', 'after'))
+    for op in SHOWN_OPS + ['total']:
+        print("{:16} {:8d} {:8d}".format(
+            op, sum(before.values()) if op == 'total' else before[op],
+            sum(after.values()) if op == 'total' else after[op]))
+
+    unfolded = sum(after[op] for op in FUSED_BATCH_NORM_OPS)
+    ok = unfolded == 0
+    if not ok:
+        print("{} batch norms were not folded".format(unfolded))
+    rng = np.random.RandomState(0)
+    for batch_size in BATCH_SIZES:
+        inputs = rng.uniform(
+            size=(batch_size, 240, 320, 3 + config.n_joints)).astype(
+                np.float32)
+        diff = np.abs(frozen.estimate(inputs) - pm_3d.estimate(inputs)).max()
+        ok = ok and diff < TOLERANCE
+        original = benchmark.time_call(pm_3d.estimate, inputs, iters=ITERS)
+        optimised = benchmark.time_call(frozen.estimate, inputs, iters=ITERS)
+        print("batch {:3d} original {:8.2f} ms frozen {:8.2f} ms x{:.2f} "
+              "max diff {:.2e}".format(
+                  batch_size, original['mean_ms'], optimised['mean_ms'],
+                  original['mean_ms'] / optimised['mean_ms'], diff))
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 export_3d_pose.py <frozen-graph.pb>\n"
+              "Exports the latest checkpoint and compares it with the "
+              "original graph")
+        sys.exit()
+    sys.exit(main(sys.argv[1]))
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import time
+import threading
+
+import numpy as np
+
+from pose_3d.inference_server import InferenceClient
+from pose_3d import config
+
+
+HOST = 'localhost'
+N_CLIENTS = 16            # concurrent callers, each with its own connection
+REQUESTS_PER_CLIENT = 50
+
+
+def client(address, seed, latencies):
+    # Random single-frame inputs of the model's shape, so no dataset needed
+    rng = np.random.RandomState(seed)
+    inputs = rng.uniform(size=(1, 240, 320, 3 + config.n_joints))
+    conn = InferenceClient(address)
+    try:
+        for _ in range(REQUESTS_PER_CLIENT):
+            start = time.perf_counter()
+            outputs = conn.estimate(inputs)
+            latencies.append(time.perf_counter() - start)
+            assert outputs.shape[0] == 1
+    finally:
+        conn.close()
+
+
+def main(address):
+    address = (HOST, int(address)) if address.isdigit() else address
+    latencies = []
+    threads = [ threading.Thread(target=client, args=(address, i, latencies))
+                for i in range(N_CLIENTS) ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total_secs = time.perf_counter() - start
+
+    ms = 1000 * np.array(latencies)
+    print("{} requests {:.1f} req/s client p50 {:.1f} ms p99 {:.1f} ms".format(
+        len(ms), len(ms) / total_secs, np.percentile(ms, 50),
+        np.percentile(ms, 99)))
+    conn = InferenceClient(address)
+    print("server", conn.stats())
+    conn.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 load_test_3d_pose_server.py "
+              "<port|unix-socket-path>\n"
+              "Sends random requests to a running serve_3d_pose.py")
+        sys.exit()
+    sys.exit(main(sys.argv[1]))
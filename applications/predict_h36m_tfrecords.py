@@ -5,14 +5,11 @@ import __init__
 
 import os
 import tensorflow as tf
-import numpy as np
-import scipy
-import scipy.io
 
-import tf_pose
 from tf_pose.estimator import TfPoseEstimator as OpPoseEstimator
 from tf_pose.networks import get_graph_path
-from pose_3d import utils
+from pose_3d import heatmap_generation
+from pose_3d.job_manifest import JobManifest
 
 tf.logging.set_verbosity(tf.logging.WARN)
 
@@ -20,6 +17,11 @@ tf.logging.set_verbosity(tf.logging.WARN)
 H36M_TFRECORD_PATH = '/mnt/Data/ben/tf_records_human36m/tf_records_human36m_wjoints/train'
 H36M_TFRECORD_PATH_OUT = '/mnt/Data/ben/tf_records_human36m/tf_records_human36m_wjoints/train_processed'
 
+BATCH_SIZE = 16     # crops per OpenPose forward pass
+CROP_SIZE = (290, 300)  # (height, width) crops are padded or cropped to
+# Completed files are recorded here
+MANIFEST_PATH = os.path.join(H36M_TFRECORD_PATH_OUT, 'heatmaps_manifest.json')
+
 
 def parse_record(record):
     dict_keys = {'image/center': tf.FixedLenFeature([2], tf.int64),
@@ -42,74 +44,86 @@ def parse_record(record):
 
     joints2d = tf.stack([f['image/x'], f['image/y']], axis=1)
     img_raw = f['image/encoded']
-    img = tf.image.decode_jpeg(img_raw)
+    img = tf.image.decode_jpeg(img_raw, channels=3)
+    # Crop or pad at the bottom and right to the same size for batching
+    img = img[:CROP_SIZE[0], :CROP_SIZE[1], :]
+    img = tf.image.pad_to_bounding_box(img, 0, 0, *CROP_SIZE)
     return img, joints2d
 
 
+def records_dataset(filename):
+    dataset = tf.data.TFRecordDataset(filename)
+    dataset = dataset.map(parse_record, num_parallel_calls=4)
+    dataset = dataset.batch(BATCH_SIZE)
+    dataset = dataset.prefetch(2)
+    return dataset
+
+
 if __name__ == '__main__':
     tfrecord_files = sorted(os.listdir(H36M_TFRECORD_PATH))
-    tfrecord_files_in = list(map(lambda f: os.path.join(H36M_TFRECORD_PATH, f),
-                                 tfrecord_files))
 
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True  # pylint: disable=no-member
     estimator = OpPoseEstimator(get_graph_path('cmu'),
                                 target_size=(300*2, 290*2), tf_config=config)
+
+    # Decode pipeline is built once and reinitialised for each file
+    filename_placeholder = tf.placeholder(tf.string, shape=[])
+    iterator = records_dataset(
+        filename_placeholder).make_initializable_iterator()
+    next_batch = iterator.get_next()
+    sess = tf.Session(config=config)
+    tf.get_default_graph().finalize()
+
+    manifest = JobManifest(MANIFEST_PATH)
     for filename in tfrecord_files:
         in_file = os.path.join(H36M_TFRECORD_PATH, filename)
-        record_iterator = tf.python_io.tf_record_iterator(in_file)
-
-        heat_mats, visibilities, mask, diffs, humans = [], [], [], [], []
-
-        for sr in record_iterator:  # one sr is one example in byte string
-            img, joints2d = parse_record(sr)
-            img, joints2d = tf.Session().run((img, joints2d))
-            if img.shape[0] > 290:
-                img = img[:290, :, :]
-            if img.shape[1] > 300:
-                img = img[:, :300, :]
-            if img.shape[0] < 290:
-                pad_0 = 290 - img.shape[0]
-                img = np.pad(img, [(0, pad_0), (0, 0), (0, 0)],
-                             'constant', constant_values=0)
-            if img.shape[1] < 300:
-                pad_1 = 300 - img.shape[1]
-                img = np.pad(img, [(0, 0), (0, pad_1), (0, 0)],
-                             'constant', constant_values=0)
-
-            h = estimator.inference(img, resize_to_default=True,
-                                    upsample_size=4.0)
-            if len(h) == 0:
-                mask.append(False)
-                human = np.zeros([14, 2], dtype=np.float32)
-                visibility = np.zeros([14], dtype=np.bool)
-            else:
-                if len(h) > 1:
-                    mask.append(False)
-                else:
-                    mask.append(True)
-                human, visibility = tf_pose.common.MPIIPart.from_coco(h[0])
-                human = np.array(human)
-                visibility = np.array(visibility)
-
-            avg_location = np.mean(human[visibility], axis=0)
-            avg_joint2d = np.mean(joints2d, axis=0)
-            diff = np.linalg.norm(avg_location - avg_joint2d)
-            diffs.append(diff)
-            humans.append(human)
-            visibilities.append(visibility)
-            heat_mats.append(estimator.heatMat[:, :, :18])
-
-        # Stacking on last axis makes .mat file smaller compared to first axis
-        out_dict = {}
-        out_dict['mask'] = np.array(mask)
-        out_dict['diffs'] = np.array(diffs)
-        out_dict['detected_2D'] = np.stack(humans, axis=-1)
-        out_dict['visibility_2D'] = np.stack(visibilities, axis=-1)
-        out_dict['heat_mat'] = np.stack(heat_mats, axis=-1)
-
         out_mat_filename = os.path.join(H36M_TFRECORD_PATH_OUT,
                                         filename[:-len('.tfrecord')] + '_maps')
-        print(out_mat_filename)
-        scipy.io.savemat(out_mat_filename, out_dict,
-                         do_compression=True, appendmat=True)
+        # Skip files which are done or claimed by another process
+        if not manifest.claim(filename):
+            continue
+        try:
+            sess.run(iterator.initializer,
+                     feed_dict={filename_placeholder: in_file})
+
+            visibilities, mask, diffs, humans = [], [], [], []
+            heat_file = None
+            while True:
+                try:
+                    imgs, joints2d = sess.run(next_batch)
+                except tf.errors.OutOfRangeError:
+                    break
+                results = heatmap_generation.inference_batch(
+                    estimator, list(imgs), upsample_size=4.0)
+                for (h, _), one_joints2d in zip(results, joints2d):
+                    usable, human, visibility, diff = (
+                        heatmap_generation.summarise_detection(
+                            h, one_joints2d))
+                    mask.append(usable)
+                    diffs.append(diff)
+                    humans.append(human)
+                    visibilities.append(visibility)
+                heat_mats = [ heat_mat[:, :, :18] for _, heat_mat in results ]
+                if heat_file is None:
+                    # Grows as needed, so each file is only read once
+                    heat_file = heatmap_generation.HeatmapFile(
+                        out_mat_filename + '_heat_mat.tmp',
+                        heat_mats[0].shape)
+                heat_file.append(heat_mats)
+
+            if heat_file is None:
+                print("No records in {}, skipped".format(in_file))
+                manifest.complete(filename, [in_file], [])
+                continue
+            print(out_mat_filename)
+            heatmap_generation.save_maps(
+                out_mat_filename, heat_file.heat_mat(), mask, diffs, humans,
+                visibilities)
+            heat_file.remove()
+        except:
+            # Let a rerun redo the file instead of waiting for the claim to
+            # time out
+            manifest.release(filename)
+            raise
+        manifest.complete(filename, [in_file], [out_mat_filename + '.mat'])
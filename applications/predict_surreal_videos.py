@@ -6,81 +6,141 @@ import __init__
 import sys
 import os
 import glob
+import multiprocessing
 
 from tf_pose.estimator import TfPoseEstimator as OpPoseEstimator
 from tf_pose.networks import get_graph_path
-import tf_pose.common
 
 import numpy as np
 import scipy.io
 import cv2
 import tensorflow as tf
 
+from pose_3d import heatmap_generation
+from pose_3d.job_manifest import JobManifest
+from pose_3d.video_frames import VideoFrames
+
+
+BATCH_SIZE = 16        # frames per OpenPose forward pass
+N_WORKERS = 2          # worker processes, each with its own OpenPose graph
+N_DECODE_THREADS = 4   # frame decoding threads per worker
+
+# Completed clips are recorded here, in the SURREAL train directory
+MANIFEST_FILENAME = 'heatmaps_manifest.json'
+
+_estimator = None  # OpenPose estimator of this worker process
+_manifest = None
+
 
 def main(surreal_path):
-    config = tf.ConfigProto()
-    config.gpu_options.allow_growth = True  # pylint: disable=no-member
-    estimator = OpPoseEstimator(get_graph_path('cmu'),
-                                target_size=(320*2, 240*2), tf_config=config)
     base_path = os.path.join(surreal_path, 'data', 'cmu', 'train')
+    frames_paths = []
     for run in ['run0']:  # + ['run1', 'run2']:
         run_path = os.path.join(base_path, run)
         dir_names = sorted(os.listdir(run_path))
         for dir_name in dir_names:
             dir_path = os.path.join(run_path, dir_name)
-            one_dir_frames_path = sorted(glob.glob(
-                os.path.join(dir_path, dir_name + '*_frames')))
-            for frames_path in one_dir_frames_path:
-                process_frames(frames_path, estimator)
+            videos = sorted(glob.glob(
+                os.path.join(dir_path, dir_name + '_c*.mp4')))
+            # Use extracted frames if there are any, otherwise the video
+            for video in videos:
+                frames_dir = video[:-len('.mp4')] + '_frames'
+                frames_paths.append(
+                    frames_dir if os.path.isdir(frames_dir) else video)
+
+    # spawn so the workers do not inherit TensorFlow state from this process
+    ctx = multiprocessing.get_context('spawn')
+    manifest_path = os.path.join(base_path, MANIFEST_FILENAME)
+    with ctx.Pool(N_WORKERS, initializer=init_worker,
+                  initargs=(manifest_path,)) as pool:
+        for out_mat_filename in pool.imap_unordered(
+                process_frames_worker, frames_paths):
+            if out_mat_filename is not None:
+                print(out_mat_filename)
+
+
+def init_worker(manifest_path):
+    global _estimator, _manifest
+    _manifest = JobManifest(manifest_path)
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True  # pylint: disable=no-member
+    _estimator = OpPoseEstimator(get_graph_path('cmu'),
+                                 target_size=(320*2, 240*2), tf_config=config)
+
+
+def process_frames_worker(in_path):
+    # Skip clips which are done or claimed by another worker
+    if not _manifest.claim(in_path):
+        return None
+    try:
+        out_mat_filename = process_frames(in_path, _estimator)
+    except:
+        _manifest.release(in_path)
+        raise
+    basename = out_mat_filename[:-len('_maps')]
+    _manifest.complete(in_path, [basename + '_info.mat', in_path],
+                       [out_mat_filename + '.mat'])
+    return out_mat_filename
+
+
+def read_frame(frame_file):
+    color_im = cv2.imread(frame_file)
+    return cv2.cvtColor(color_im, cv2.COLOR_BGR2RGB)
 
 
 def process_frames(in_path, estimator):
-    print(in_path)
+    # in_path is either a directory of extracted frames or the clip's video
+    if in_path.endswith('.mp4'):
+        basename = in_path[:-len('.mp4')]
+        with VideoFrames(in_path) as video:
+            frame_batches = heatmap_generation.background_batches(
+                video, BATCH_SIZE)
+            try:
+                return process_batches(basename, frame_batches, estimator)
+            finally:
+                # Stops the decoding thread before the video is released
+                frame_batches.close()
     basename = in_path[:-len("_frames")]
+    frames_files = [ os.path.join(in_path, f)
+                     for f in sorted(os.listdir(in_path)) ]
+    frame_batches = heatmap_generation.prefetch_batches(
+        read_frame, frames_files, BATCH_SIZE, N_DECODE_THREADS)
+    return process_batches(basename, frame_batches, estimator)
+
+
+def process_batches(basename, frame_batches, estimator):
     info_filename = basename + '_info.mat'
     info_dict = scipy.io.loadmat(info_filename)
     joints2d = np.transpose(info_dict['joints2D'], (2, 1, 0)) # T, 24, 2
-    frames_files = [ os.path.join(in_path, f)
-                     for f in sorted(os.listdir(in_path)) ]
-    assert len(frames_files) == joints2d.shape[0]
-
-    humans, visibilities, heat_mats, diffs, mask = [], [], [], [], []
-    for idx, frame_file in enumerate(frames_files):
-        color_im = cv2.imread(frame_file)
-        color_im = cv2.cvtColor(color_im, cv2.COLOR_BGR2RGB)
-        human = estimator.inference(color_im,
-                                    resize_to_default=True, upsample_size=4.0)
-        if len(human) == 0:
-            mask.append(False)
-            human = np.zeros([14, 2], dtype=np.float32)
-            visibility = np.zeros([14], dtype=np.bool)
-        else:
-            if len(human) > 1:
-                mask.append(False)
-            else:
-                mask.append(True)
-            human, visibility = tf_pose.common.MPIIPart.from_coco(human[0])
-            human = np.array(human)
-            visibility = np.array(visibility)
-        avg_location = np.mean(human[visibility], axis=0)
-        avg_joint2d = np.mean(joints2d[idx], axis=0)
-        diff = np.linalg.norm(avg_location - avg_joint2d)
-        diffs.append(diff)
-        humans.append(human)
-        visibilities.append(visibility)
-        heat_mats.append(estimator.heatMat)
-
-    out_dict = {}
-    out_dict['mask'] = np.array(mask)
-    out_dict['diffs'] = np.array(diffs)
-    out_dict['detected_2D'] = np.stack(humans, axis=-1)
-    out_dict['visibility_2D'] = np.stack(visibilities, axis=-1)
-    out_dict['heat_mat'] = np.stack(heat_mats, axis=-1)
+
+    humans, visibilities, diffs, mask = [], [], [], []
+    heat_file = None
+    idx = 0
+    for frames in frame_batches:
+        results = heatmap_generation.inference_batch(
+            estimator, frames, upsample_size=4.0)
+        for human, _ in results:
+            usable, human, visibility, diff = (
+                heatmap_generation.summarise_detection(human, joints2d[idx]))
+            mask.append(usable)
+            diffs.append(diff)
+            humans.append(human)
+            visibilities.append(visibility)
+            idx += 1
+        heat_mats = [ heat_mat for _, heat_mat in results ]
+        if heat_file is None:
+            heat_file = heatmap_generation.HeatmapFile(
+                basename + '_heat_mat.tmp', heat_mats[0].shape,
+                joints2d.shape[0])
+        heat_file.append(heat_mats)
+    assert idx == joints2d.shape[0]
 
     out_mat_filename = basename + '_maps'
-    print(out_mat_filename)
-    scipy.io.savemat(out_mat_filename, out_dict,
-                     do_compression=True, appendmat=True)
+    heatmap_generation.save_maps(out_mat_filename, heat_file.heat_mat(),
+                                 mask, diffs, humans, visibilities)
+    heat_file.remove()
+    return out_mat_filename
+
 
 if __name__ == '__main__':
     if len(sys.argv) != 2:
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import os
+
+import tensorflow as tf
+import numpy as np
+
+from pose_3d.pose_model_3d import PoseModel3d
+from pose_3d.quantize import (representative_inputs, quantize_frozen_graph,
+                              QuantizedPoseModel3d)
+from pose_3d.data_helpers import dataset_from_filenames_surreal
+from pose_3d.data_helpers import load_bad_files
+from pose_3d import benchmark
+from pose_3d import config
+from pose_3d import dataset_manifest
+
+
+DATASET_PATH = '/mnt/Data/ben/surreal/SURREAL/data/cmu/train/run0/'
+SUMMARY_DIR = '/tmp/tf_logs/3d_pose_quantize'
+SAVER_PATH = '/home/ben/tensorflow_logs/3d_pose/ckpts/3d_pose.ckpt'
+# Written by validate_data.py - clips listed in it are excluded
+BAD_FILES_REPORT = os.path.join(DATASET_PATH, 'bad_files.json')
+N_CALIBRATION_CLIPS = 50
+N_CALIBRATION_EXAMPLES = 200
+N_EVAL_CLIPS = 50  # different clips from the calibration ones
+EVAL_BATCH_SIZE = 16
+SMPL_MODEL_PATH = os.path.join(__init__.project_path, 'data', 'SMPL_model',
+                               'models_numpy', 'model_neutral_np.pkl')
+
+
+def surreal_dataset(clips):
+    maps_files, info_files, frames_paths = dataset_manifest.clip_files(clips)
+    return dataset_from_filenames_surreal(maps_files, info_files,
+                                          frames_paths)
+
+
+def evaluate(clips, estimate_fn=None):
+    """ Mean pose and reprojection errors of the checkpoint on clips, or of
+    estimate_fn if given (PoseModel3d.evaluate restores the checkpoint) """
+    graph = tf.Graph()
+    with graph.as_default():
+        dataset = surreal_dataset(clips).batch(EVAL_BATCH_SIZE)
+    pm_3d = PoseModel3d((None, 240, 320, 3 + config.n_joints),
+                        graph,
+                        mode='eval',
+                        dataset=dataset,
+                        summary_dir=SUMMARY_DIR,
+                        saver_path=SAVER_PATH,
+                        restore_model=True,
+                        smpl_model=SMPL_MODEL_PATH)
+    pose_errors, reproj_errors = pm_3d.evaluate(estimate_fn)
+    return np.mean(pose_errors), np.mean(reproj_errors)
+
+
+def main(out_dir):
+    if tf.train.latest_checkpoint(os.path.dirname(SAVER_PATH)) is None:
+        print("No checkpoint in {}".format(os.path.dirname(SAVER_PATH)))
+        return 1
+    os.makedirs(out_dir, exist_ok=True)
+    frozen_path = os.path.join(out_dir, '3d_pose.pb')
+    tflite_path = os.path.join(out_dir, '3d_pose_int8.tflite')
+
+    pm_3d = PoseModel3d((None, 240, 320, 3 + config.n_joints),
+                        tf.Graph(),
+                        mode='test',
+                        summary_dir=SUMMARY_DIR,
+                        saver_path=SAVER_PATH,
+                        restore_model=True)
+    pm_3d.export_inference_graph(frozen_path)
+
+    manifest = dataset_manifest.load_manifest(DATASET_PATH, refresh=False)
+    clips = dataset_manifest.manifest_clips(
+        manifest, exclude=load_bad_files(BAD_FILES_REPORT))
+    rng = np.random.RandomState(0)
+    clips = [ clips[i] for i in rng.permutation(len(clips)) ]
+    calibration_clips = clips[:N_CALIBRATION_CLIPS]
+    eval_clips = clips[N_CALIBRATION_CLIPS:
+                       N_CALIBRATION_CLIPS + N_EVAL_CLIPS]
+
+    with tf.Graph().as_default():
+        calibration = representative_inputs(
+            surreal_dataset(calibration_clips), N_CALIBRATION_EXAMPLES)
+    print("Calibrating on {} examples".format(len(calibration)), flush=True)
+    quantize_frozen_graph(frozen_path, tflite_path, calibration)
+    quantized = QuantizedPoseModel3d(tflite_path)
+    print("Wrote {} ({:.1f} MB, frozen float32 {:.1f} MB)".format(
+        tflite_path, os.path.getsize(tflite_path) / 2**20,
+        os.path.getsize(frozen_path) / 2**20))
+
+    inputs = calibration[:1]
+    for name, estimate in [('float32', pm_3d.estimate),
+                           ('int8', quantized.estimate)]:
+        timing = benchmark.time_call(estimate, inputs, iters=20)
+        print("{:8} {:8.2f} ms per example".format(name, timing['mean_ms']))
+
+    pose_32, reproj_32 = evaluate(eval_clips)
+    pose_8, reproj_8 = evaluate(eval_clips, quantized.estimate)
+    print("{:14} {:>12} {:>12} {:>12}".format('', 'float32', 'int8', 'delta'))
+    print("{:14} {:12.4g} {:12.4g} {:+12.4g}".format(
+        'pose error', pose_32, pose_8, pose_8 - pose_32))
+    print("{:14} {:12.4g} {:12.4g} {:+12.4g}".format(
+        'reproj error', reproj_32, reproj_8, reproj_8 - reproj_32))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 quantize_3d_pose.py <output-dir>\n"
+              "Quantises the latest checkpoint to int8 and compares it with "
+              "the float32 model")
+        sys.exit()
+    sys.exit(main(sys.argv[1]))
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import os
+import time
+import threading
+
+import tensorflow as tf
+
+from pose_3d.pose_model_3d import PoseModel3d
+from pose_3d.inference_server import DynamicBatcher, make_server
+from pose_3d import config
+
+
+SAVER_PATH = '/home/ben/tensorflow_logs/3d_pose/ckpts/3d_pose.ckpt'
+SUMMARY_DIR = '/tmp/tf_logs/3d_pose_server'
+HOST = 'localhost'
+MAX_BATCH_SIZE = 32
+MAX_LATENCY_MS = 10.0  # longest a request waits for others to batch with
+STATS_SECS = 10
+
+
+def main(address):
+    # A port number serves on HOST, anything else is a Unix socket path
+    address = (HOST, int(address)) if address.isdigit() else address
+    input_shape = (None, 240, 320, 3 + config.n_joints)
+    pm_3d = PoseModel3d(input_shape,
+                        tf.Graph(),
+                        mode='test',
+                        summary_dir=SUMMARY_DIR,
+                        saver_path=SAVER_PATH,
+                        restore_model=True)
+    batcher = DynamicBatcher(pm_3d.estimate, input_shape[1:], MAX_BATCH_SIZE,
+                             MAX_LATENCY_MS)
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)  # left by a previous run
+    server = make_server(batcher, address)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Serving on {}".format(address), flush=True)
+    try:
+        while True:
+            time.sleep(STATS_SECS)
+            print(' '.join('{} {:.4g}'.format(k, v)
+                           for k, v in batcher.stats().items()), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 serve_3d_pose.py <port|unix-socket-path>")
+        sys.exit()
+    sys.exit(main(sys.argv[1]))
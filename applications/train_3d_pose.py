@@ -4,57 +4,67 @@
 import __init__
 
 import os
-import glob
 import random
 
 import tensorflow as tf
 
 from pose_3d.pose_model_3d import PoseModel3d
 from pose_3d.data_helpers import dataset_from_filenames_surreal
+from pose_3d.data_helpers import load_bad_files
+from pose_3d.data_helpers import dataset_from_shards_surreal
+from pose_3d.data_helpers import dataset_from_shards_surreal_frames
 from pose_3d import config
+from pose_3d import dataset_manifest
 
 
 DATASET_PATH = '/mnt/Data/ben/surreal/SURREAL/data/cmu/train/run0/'
 SUMMARY_DIR = '/home/ben/tensorflow_logs/3d_pose'
 SAVER_PATH = '/home/ben/tensorflow_logs/3d_pose/ckpts/3d_pose.ckpt'
+# Written by validate_data.py - clips listed in it are excluded
+BAD_FILES_REPORT = os.path.join(DATASET_PATH, 'bad_files.json')
+# Output of convert_surreal_to_shards.py - read instead of DATASET_PATH if set
+SHARDS_PATH = None
+# Shuffle a global frame index of the shards instead of a buffer of examples
+FRAME_INDEX = True
+# Keep images and heatmaps as float16 through the input pipeline
+COMPACT_INPUTS = True
+# Cache of preprocessed examples, so only the first epoch decodes the dataset
+CACHE_DIR = None
+CACHE_MAX_BYTES = 200 * 2**30
+# tf.float16 or tf.bfloat16 for mixed precision - see check_mixed_precision.py
+COMPUTE_DTYPE = tf.float32
+# Batches whose gradients are averaged per update (effective batch size
+# BATCH_SIZE * ACCUMULATE_STEPS). BATCH_SIZE also sets the shuffle buffer
+BATCH_SIZE = 32
+ACCUMULATE_STEPS = 1
 
 
 if __name__ == '__main__':
-    dataset_dir = os.path.realpath(DATASET_PATH)
-    basenames = sorted(os.listdir(dataset_dir))
-
     smpl_path = os.path.join(
         __init__.project_path, 'data', 'SMPL_model', 'models_numpy')
     smpl_neutral = os.path.join(smpl_path, 'model_neutral_np.pkl')
 
-    maps_files = []
-    info_files = []
-    frames_paths = []
-    for basename in basenames:
-        # each basename is one dir corresponding to one type of action
-        one_data_dir = os.path.join(dataset_dir, basename)
-        one_dir_maps_files = sorted(glob.glob(
-            os.path.join(one_data_dir, basename + '_c*_maps.mat')))
-        # only get the info file and frames for heatmaps that exist
-        one_dir_info_files = map(lambda f: f[:-len('_maps.mat')] + '_info.mat',
-                                 one_dir_maps_files)
-        one_dir_frames_paths = map(lambda f: f[:-len('_maps.mat')] + '_frames',
-                                   one_dir_maps_files)
-        maps_files.extend(one_dir_maps_files)
-        info_files.extend(one_dir_info_files)
-        frames_paths.extend(one_dir_frames_paths)
+    # Only directories changed since the last run are rescanned
+    manifest = dataset_manifest.load_manifest(DATASET_PATH)
+    clips = dataset_manifest.manifest_clips(
+        manifest, exclude=load_bad_files(BAD_FILES_REPORT))
 
     # Shuffle file order
-    all_files = list(zip(maps_files, info_files, frames_paths))
-    random.shuffle(all_files)
-    maps_files, info_files, frames_paths = zip(*all_files)
-    maps_files, info_files, frames_paths = (
-        list(maps_files), list(info_files), list(frames_paths))
+    random.shuffle(clips)
+    maps_files, info_files, frames_paths = dataset_manifest.clip_files(clips)
 
     graph = tf.Graph()
     with graph.as_default():
-        dataset = dataset_from_filenames_surreal(
-            maps_files, info_files, frames_paths)
+        if SHARDS_PATH is not None and FRAME_INDEX:
+            dataset = dataset_from_shards_surreal_frames(
+                SHARDS_PATH, compact=COMPACT_INPUTS)
+        elif SHARDS_PATH is not None:
+            dataset = dataset_from_shards_surreal(
+                SHARDS_PATH, compact=COMPACT_INPUTS)
+        else:
+            dataset = dataset_from_filenames_surreal(
+                maps_files, info_files, frames_paths, compact=COMPACT_INPUTS,
+                cache_dir=CACHE_DIR, cache_max_bytes=CACHE_MAX_BYTES)
 
     pm_3d = PoseModel3d((None, 240, 320, 3 + config.n_joints),
                         graph,
@@ -67,6 +77,12 @@ if __name__ == '__main__':
                         mesh_loss=True,
                         reproject_loss=True,
                         smpl_model=smpl_neutral,
-                        discriminator=False)
+                        discriminator=False,
+                        compute_dtype=COMPUTE_DTYPE)
 
-    pm_3d.train(batch_size=32, epochs=500)
+    # The frame index dataset is already shuffled over the whole dataset
+    shuffle_buffer = 0 if SHARDS_PATH is not None and FRAME_INDEX else None
+    pm_3d.train(batch_size=BATCH_SIZE, epochs=500,
+                shuffle_buffer=shuffle_buffer,
+                examples_per_epoch=dataset_manifest.n_usable_frames(clips),
+                accumulate_steps=ACCUMULATE_STEPS)
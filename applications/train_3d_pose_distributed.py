@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import os
+import random
+import multiprocessing
+
+import tensorflow as tf
+
+from pose_3d.pose_model_3d import PoseModel3d
+from pose_3d.data_helpers import dataset_from_filenames_surreal
+from pose_3d.data_helpers import load_bad_files
+from pose_3d import config
+from pose_3d import dataset_manifest
+from pose_3d import distributed
+
+
+DATASET_PATH = '/mnt/Data/ben/surreal/SURREAL/data/cmu/train/run0/'
+SUMMARY_DIR = '/home/ben/tensorflow_logs/3d_pose'
+SAVER_PATH = '/home/ben/tensorflow_logs/3d_pose/ckpts/3d_pose.ckpt'
+# Written by validate_data.py - clips listed in it are excluded
+BAD_FILES_REPORT = os.path.join(DATASET_PATH, 'bad_files.json')
+N_WORKERS = 4
+N_PS = 1
+BASE_PORT = 2222
+# Hide any GPUs so several workers can be run on a CPU-only node
+CPU_ONLY = True
+# Batch size per worker - each synchronous step uses N_WORKERS batches
+BATCH_SIZE = 32
+EPOCHS = 500
+COMPACT_INPUTS = True
+# How long the other workers get to stop after the chief has finished
+WORKER_STOP_SECS = 300
+
+
+def run_ps(cluster, task_index):
+    server = distributed.start_server(cluster, 'ps', task_index)
+    server.join()
+
+
+def run_worker(cluster, task_index, clips, examples_per_epoch):
+    server = distributed.start_server(cluster, 'worker', task_index)
+
+    smpl_path = os.path.join(
+        __init__.project_path, 'data', 'SMPL_model', 'models_numpy')
+    smpl_neutral = os.path.join(smpl_path, 'model_neutral_np.pkl')
+
+    random.shuffle(clips)
+    maps_files, info_files, frames_paths = dataset_manifest.clip_files(clips)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        dataset = dataset_from_filenames_surreal(
+            maps_files, info_files, frames_paths, compact=COMPACT_INPUTS)
+
+    pm_3d = PoseModel3d((None, 240, 320, 3 + config.n_joints),
+                        graph,
+                        mode='train',
+                        dataset=dataset,
+                        summary_dir=SUMMARY_DIR,
+                        saver_path=SAVER_PATH,
+                        restore_model=True,
+                        pose_loss=True,
+                        mesh_loss=True,
+                        reproject_loss=True,
+                        smpl_model=smpl_neutral,
+                        discriminator=False,
+                        server=server)
+    pm_3d.train(batch_size=BATCH_SIZE, epochs=EPOCHS,
+                examples_per_epoch=examples_per_epoch)
+
+
+if __name__ == '__main__':
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else N_WORKERS
+    if CPU_ONLY:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+    manifest = dataset_manifest.load_manifest(DATASET_PATH)
+    clips = dataset_manifest.manifest_clips(
+        manifest, exclude=load_bad_files(BAD_FILES_REPORT))
+    # Each worker reads a disjoint set of clips with about the same number
+    # of frames, so they run through their shards at the same rate
+    worker_clips = dataset_manifest.shard_clips_balanced(clips, n_workers)
+    examples_per_epoch = dataset_manifest.n_usable_frames(clips)
+
+    cluster = distributed.local_cluster(
+        n_workers, n_ps=N_PS, base_port=BASE_PORT).as_dict()
+    # spawn so no process inherits TensorFlow state from this one
+    ctx = multiprocessing.get_context('spawn')
+    ps_procs = [ ctx.Process(target=run_ps, args=(cluster, i), daemon=True)
+                 for i in range(N_PS) ]
+    workers = [ ctx.Process(target=run_worker,
+                            args=(cluster, i, worker_clips[i],
+                                  examples_per_epoch))
+                for i in range(n_workers) ]
+    for proc in ps_procs + workers:
+        proc.start()
+    # The chief decides when training ends; a worker left blocked on a
+    # synchronous step is stopped
+    workers[0].join()
+    for proc in workers[1:]:
+        proc.join(WORKER_STOP_SECS)
+        if proc.is_alive():
+            print("Worker {} did not stop, terminating".format(proc.name))
+            proc.terminate()
+            proc.join()
+    # Parameter servers never return from join, so stop them
+    for proc in ps_procs:
+        proc.terminate()
+    sys.exit(max(abs(proc.exitcode) for proc in workers))
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+import __init__
+
+import sys
+import os
+import json
+import zlib
+import multiprocessing
+
+import numpy as np
+import scipy.io
+from scipy.io.matlab import MatReadError
+
+from pose_3d import config
+from pose_3d import dataset_manifest
+
+
+DATASET_PATH = '/mnt/Data/ben/surreal/SURREAL/data/cmu/train/run0/'
+# Report of bad files, loaded by the training scripts to exclude them
+REPORT_PATH = os.path.join(DATASET_PATH, 'bad_files.json')
+N_WORKERS = os.cpu_count()
+CHECK_HEATMAPS = True
+CHECK_JOINTS = True
+
+
+def mat_shapes(mat_file):
+    # Only reads the variable headers, not the data
+    return {name: shape for name, shape, _ in scipy.io.whosmat(mat_file)}
+
+
+def validate(files):
+    """ Returns a list of reasons the clip is bad - empty if it is fine """
+    maps_file, info_file = files
+    reasons = []
+    n_frames = None
+    try:
+        if CHECK_HEATMAPS:
+            shapes = mat_shapes(maps_file)
+            # heat_mat: height, width, channels, time
+            heat_shape = shapes.get('heat_mat')
+            if heat_shape is None or len(heat_shape) != 4:
+                reasons.append('heat_mat missing or not 4D')
+            else:
+                n_frames = heat_shape[3]
+                if heat_shape[0] != config.input_img_size[0]:
+                    reasons.append('heat_mat height {}'.format(heat_shape[0]))
+                if heat_shape[2] < config.n_joints:
+                    reasons.append('heat_mat has {} channels'.format(
+                        heat_shape[2]))
+                if np.prod(shapes.get('mask', (0,))) != n_frames:
+                    reasons.append('mask length does not match heat_mat')
+        if CHECK_JOINTS:
+            shapes = mat_shapes(info_file)
+            # joints2D: [2x24xT], pose: [72xT]
+            joints_shape = shapes.get('joints2D')
+            if joints_shape is None or tuple(joints_shape[:2]) != (2, 24):
+                reasons.append('joints2D shape {}'.format(joints_shape))
+            pose_shape = shapes.get('pose')
+            if pose_shape is None or pose_shape[0] != 72:
+                reasons.append('pose shape {}'.format(pose_shape))
+            elif n_frames is not None and pose_shape[1] != n_frames:
+                reasons.append('{} poses for {} heatmaps'.format(
+                    pose_shape[1], n_frames))
+            else:
+                pose = scipy.io.loadmat(info_file,
+                                        variable_names=['pose'])['pose']
+                if not np.all(np.abs(pose) < 2 * np.pi):
+                    reasons.append('pose out of range or not finite')
+    except (OSError, ValueError, TypeError, MatReadError, zlib.error) as e:
+        # MatReadError or zlib.error for empty or truncated files
+        reasons.append('unreadable: {}'.format(e))
+    return maps_file, info_file, reasons
+
+
+if __name__ == '__main__':
+    dataset_dir = os.path.realpath(DATASET_PATH)
+    # Includes the clips the manifest could not read, so they are reported
+    manifest = dataset_manifest.load_manifest(dataset_dir,
+                                              n_workers=N_WORKERS)
+    clips = dataset_manifest.manifest_clips(manifest, include_errors=True)
+    maps_files, info_files, _ = dataset_manifest.clip_files(clips)
+
+    bad = []
+    with multiprocessing.Pool(N_WORKERS) as pool:
+        for maps_file, info_file, reasons in pool.imap_unordered(
+                validate, zip(maps_files, info_files), chunksize=16):
+            if reasons:
+                print(maps_file, '; '.join(reasons))
+                bad.append({'maps_file': maps_file, 'info_file': info_file,
+                            'reasons': reasons})
+
+    report = {'dataset': dataset_dir,
+              'n_checked': len(maps_files),
+              'bad': sorted(bad, key=lambda b: b['maps_file'])}
+    with open(REPORT_PATH + '.tmp', 'w') as f:
+        json.dump(report, f, indent=1)
+    os.replace(REPORT_PATH + '.tmp', REPORT_PATH)
+    print("{} of {} clips are bad".format(len(bad), len(maps_files)))
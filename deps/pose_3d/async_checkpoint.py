@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+import time
+import threading
+
+import tensorflow as tf
+
+
+LOG_FILENAME = 'checkpoint_log.jsonl'
+
+
+class AsyncCheckpointer:
+    """ Writes checkpoints from a background thread. save() only copies the
+    variables to local shadow variables (a device-side copy) in the calling
+    thread; a Saver mapping the original variable names to the shadows then
+    writes them, so the checkpoints restore with a normal tf.train.Saver.
+    Keeps the keep_last latest checkpoints plus the keep_best with the lowest
+    metric, and appends the step, metric, write time and size of each one to
+    checkpoint_log.jsonl next to them. Must be created before the graph is
+    finalized """
+    def __init__(self, sess, var_list, saver_path, keep_last=5, keep_best=2,
+                 device=None):
+        self.sess = sess
+        self.saver_path = saver_path
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.ckpt_dir = os.path.dirname(saver_path)
+        self.log_path = os.path.join(self.ckpt_dir, LOG_FILENAME)
+        os.makedirs(self.ckpt_dir, exist_ok=True)
+
+        with tf.name_scope('checkpoint_snapshot'), tf.device(device):
+            shadows = [ tf.Variable(tf.zeros(v.shape, v.dtype.base_dtype),
+                                    trainable=False,
+                                    collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                        for v in var_list ]
+            self.snapshot = tf.group(*[ shadow.assign(v) for shadow, v
+                                        in zip(shadows, var_list) ])
+        self.saver = tf.train.Saver(
+            { v.op.name: shadow for v, shadow in zip(var_list, shadows) },
+            max_to_keep=None)
+        sess.run(tf.variables_initializer(shadows))
+
+        self.records = self._load_records()
+        self._thread = None
+        self.last_step = None
+        self.n_skipped = 0
+
+    def _load_records(self):
+        # Checkpoints from earlier runs which still exist take part in the
+        # retention policy
+        records = {}
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if glob.glob(record['path'] + '.index'):
+                        records[record['path']] = record
+        except OSError:
+            pass
+        return sorted(records.values(), key=lambda r: r['step'])
+
+    def save(self, step: int, metric=None, block=False):
+        """ Snapshot the variables and start writing them. If the previous
+        checkpoint is still being written the save is skipped and False is
+        returned, unless block, which waits for it """
+        if step == self.last_step:
+            return True
+        if self._thread is not None and self._thread.is_alive():
+            if not block:
+                self.n_skipped += 1
+                return False
+            self._thread.join()
+        self.sess.run(self.snapshot)
+        self.last_step = step
+        self._thread = threading.Thread(target=self._write,
+                                        args=(step, metric), daemon=True)
+        self._thread.start()
+        return True
+
+    def close(self):
+        """ Wait for the checkpoint being written, if any """
+        if self._thread is not None:
+            self._thread.join()
+
+    def _write(self, step, metric):
+        start = time.time()
+        path = self.saver.save(self.sess, self.saver_path, global_step=step,
+                               write_meta_graph=False, write_state=False)
+        size = sum(os.path.getsize(f) for f in glob.glob(path + '.*'))
+        record = {'step': int(step), 'path': path,
+                  'metric': None if metric is None else float(metric),
+                  'write_secs': time.time() - start, 'size_bytes': size,
+                  'time': time.time()}
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self.records = [ r for r in self.records if r['path'] != path ]
+        self.records.append(record)
+        self._apply_retention()
+        tf.train.update_checkpoint_state(
+            self.ckpt_dir, path,
+            all_model_checkpoint_paths=[ r['path'] for r in self.records ])
+
+    def _apply_retention(self):
+        latest = self.records[-self.keep_last:]
+        with_metric = [ r for r in self.records if r['metric'] is not None ]
+        best = sorted(with_metric, key=lambda r: r['metric'])[:self.keep_best]
+        keep = { r['path'] for r in latest + best }
+        for record in self.records:
+            if record['path'] not in keep:
+                for f in glob.glob(record['path'] + '.*'):
+                    os.remove(f)
+        self.records = [ r for r in self.records if r['path'] in keep ]
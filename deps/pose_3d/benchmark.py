@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import socket
+import platform
+import subprocess
+
+import numpy as np
+import tensorflow as tf
+
+
+def summarise_times(secs):
+    """ Timing statistics in milliseconds of a list of durations """
+    ms = 1000 * np.array(secs)
+    return {'mean_ms': float(ms.mean()), 'std_ms': float(ms.std()),
+            'min_ms': float(ms.min()), 'median_ms': float(np.median(ms)),
+            'iters': len(ms)}
+
+
+def time_run(sess, fetches, feed_dict=None, warmup=3, iters=20):
+    """ Time sess.run(fetches) after warmup runs, which include the one-off
+    graph optimisation and memory allocation """
+    for _ in range(warmup):
+        sess.run(fetches, feed_dict=feed_dict)
+    secs = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        sess.run(fetches, feed_dict=feed_dict)
+        secs.append(time.perf_counter() - start)
+    return summarise_times(secs)
+
+
+def time_call(fn, *args, warmup=1, iters=5):
+    """ Time a plain Python/numpy function """
+    for _ in range(warmup):
+        fn(*args)
+    secs = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn(*args)
+        secs.append(time.perf_counter() - start)
+    return summarise_times(secs)
+
+
+def random_variable(shape, minval=0.0, maxval=1.0, seed=0):
+    """ Synthetic input as a non-trainable variable with a random
+    initializer: unlike a constant it is not folded away by the graph
+    optimiser, and unlike a feed it is not copied in on every run """
+    return tf.Variable(tf.random_uniform(shape, minval, maxval, seed=seed),
+                       trainable=False)
+
+
+def grid_mesh(n_rows: int, n_cols: int):
+    """ Synthetic triangle mesh: a grid of n_rows * n_cols vertices wrapped
+    into a torus, two triangles per cell. Every vertex is in 6 faces, so
+    vertex_faces_from_face_verts needs no out of range padding (which
+    tf.gather rejects on the CPU). Returns vertices [n_vertices, 3] float32
+    and faces [n_faces, 3] int32 """
+    u, v = np.meshgrid(np.linspace(0, 2 * np.pi, n_cols, endpoint=False),
+                       np.linspace(0, 2 * np.pi, n_rows, endpoint=False))
+    ring = 1.0 + 0.3 * np.cos(v)
+    vertices = np.stack([ring * np.cos(u), 0.3 * np.sin(v),
+                         ring * np.sin(u)], axis=-1).reshape(-1, 3)
+
+    v00 = np.arange(n_rows * n_cols).reshape(n_rows, n_cols)
+    v01 = np.roll(v00, -1, axis=1)
+    v10 = np.roll(v00, -1, axis=0)
+    v11 = np.roll(v01, -1, axis=0)
+    v00, v01, v10, v11 = v00.ravel(), v01.ravel(), v10.ravel(), v11.ravel()
+    faces = np.concatenate([np.stack([v00, v10, v01], axis=1),
+                            np.stack([v01, v10, v11], axis=1)])
+    return vertices.astype(np.float32), faces.astype(np.int32)
+
+
+def environment():
+    """ What the results were measured on, to check before comparing """
+    env = {'host': socket.gethostname(),
+           'platform': platform.platform(),
+           'python': platform.python_version(),
+           'tensorflow': tf.__version__,
+           'cpu_count': os.cpu_count(),
+           'time': time.time()}
+    try:
+        env['git_commit'] = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return env
+
+
+def write_results(path, results):
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def _result_key(result):
+    return result['name'], tuple(sorted(result['params'].items()))
+
+
+def compare_results(baseline_path, results):
+    """ (name, params, baseline mean ms, mean ms, ratio) for the results
+    which are also in the baseline file. A ratio above 1 is slower """
+    with open(baseline_path) as f:
+        baseline = { _result_key(r): r for r in json.load(f)['results'] }
+    comparison = []
+    for result in results:
+        old = baseline.get(_result_key(result))
+        if old is not None:
+            comparison.append((result['name'], result['params'],
+                               old['mean_ms'], result['mean_ms'],
+                               result['mean_ms'] / old['mean_ms']))
+    return comparison
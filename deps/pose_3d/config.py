@@ -23,6 +23,10 @@ reproj_loss_scale = 1.0 * ss
 cam_loss_scale = (1 / (400 * n_joints_smpl))  # 400 = sqrt(240^2 + 320^2)
 cam_angle_loss_scale = 10.0
 
+# SURREAL frame selection
+max_detection_diff = 250  # max distance (px) between OpenPose and GT centres
+frame_skip = 2            # only take every n-th usable frame
+
 
 # 2D joint order and locations for various datasets
 # SMPL model joints order:
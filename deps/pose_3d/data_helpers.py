@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
+import os
 import glob
+import json
 import scipy.io
 import cv2
 import numpy as np
@@ -8,17 +10,45 @@ import tensorflow as tf
 
 import tf_pose.common
 from . import config
-
-
-def dataset_from_filenames_surreal(maps_files, info_files, frames_paths):
+from .surreal_shards import SurrealShards
+from .example_cache import ExampleCache
+from .video_frames import read_video_frames
+from .pipeline_stats import timed_reader
+
+
+def dataset_from_filenames_surreal(maps_files, info_files, frames_paths,
+                                   compact=False, cache_dir=None,
+                                   cache_max_bytes=200 * 2**30):
+    # If compact, images and heatmaps are passed through the pipeline as
+    # float16 (images unnormalised in [0, 255]) and are converted to float32
+    # and normalised at the start of network.build_model
+    # If cache_dir is given, preprocessed examples are cached on disk there
     dataset = tf.data.Dataset.from_tensor_slices(
             (maps_files, info_files, frames_paths))
 
+    cache = ExampleCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+    @timed_reader
+    def read_example(maps_file, info_file, frames_path):
+        if cache is None:
+            return read_maps_poses_images_surreal(
+                maps_file, info_file, frames_path, compact)
+        # Examples also depend on the frame selection config
+        key = cache.key([maps_file, info_file, frames_path], compact,
+                        config.n_joints, config.frame_skip,
+                        config.max_detection_diff)
+        example = cache.get(key)
+        if example is None:
+            example = read_maps_poses_images_surreal(
+                maps_file, info_file, frames_path, compact)
+            cache.put(key, example)
+        return example
+
     dataset = dataset.apply(
         tf.contrib.data.parallel_interleave(
             lambda mf, pf, fp: tf.data.Dataset.from_tensor_slices(tuple(
-                tf.py_func(read_maps_poses_images_surreal,
-                           [mf, pf, fp], [tf.float32] * 5, stateful=False))),
+                tf.py_func(read_example, [mf, pf, fp],
+                           _example_types(compact), stateful=False))),
         cycle_length=12, block_length=1, sloppy=True,
         buffer_output_elements=32, prefetch_input_elements=4))
 
@@ -40,53 +70,235 @@ def dataset_from_filenames_h36m(maps_files, record_files):
     return h36m_dataset
 
 
-def read_maps_poses_images_surreal(maps_file, info_file, frames_path):
-    maps_dict = scipy.io.loadmat(maps_file)
+def dataset_from_shards_surreal(shards_dir, compact=False):
+    # Same output as dataset_from_filenames_surreal, but reads the
+    # memory-mapped shards written by applications/convert_surreal_to_shards.py
+    shards = SurrealShards(shards_dir)
+    dataset = tf.data.Dataset.range(shards.n_clips)
+
+    @timed_reader
+    def read_clip(clip_idx):
+        return read_shards_surreal(shards, shards.clip_rows(clip_idx),
+                                   compact)
+
+    dataset = dataset.apply(
+        tf.contrib.data.parallel_interleave(
+            lambda clip_idx: tf.data.Dataset.from_tensor_slices(tuple(
+                tf.py_func(read_clip, [clip_idx],
+                           _example_types(compact), stateful=False))),
+        cycle_length=12, block_length=1, sloppy=True,
+        buffer_output_elements=32, prefetch_input_elements=4))
+
+    return dataset
+
+
+def dataset_from_shards_surreal_frames(shards_dir, read_batch_size=64,
+                                       compact=False):
+    # Frame-level dataset over a global index of (clip, frame) rows, shuffled
+    # up front. Only the row indices are held in the shuffle buffer, so
+    # shuffling is uniform over the whole dataset without materialising
+    # examples; frames are then fetched from the shards by random access.
+    shards = SurrealShards(shards_dir)
+    rows = shards.frame_rows()
+    dataset = tf.data.Dataset.from_tensor_slices(rows)
+    dataset = dataset.shuffle(len(rows), reshuffle_each_iteration=True)
+    dataset = dataset.batch(read_batch_size)
+
+    @timed_reader
+    def read_rows(batch_rows):
+        return read_shards_surreal(shards, batch_rows, compact)
+
+    dataset = dataset.map(
+        lambda batch_rows: tuple(tf.py_func(
+            read_rows, [batch_rows], _example_types(compact),
+            stateful=False)),
+        num_parallel_calls=4)
+    dataset = dataset.apply(tf.contrib.data.unbatch())
+
+    return dataset
+
+
+# Reorder heatmaps - swap lefts and rights since image and 3D GT are flipped
+# in SURREAL (see config.py)
+_reord = [0, 1, 5, 6, 7, 2, 3, 4, 11, 12, 13, 8, 9, 10, 15, 14, 17, 16, 18]
+
+
+def _example_types(compact: bool):
+    # concat (heatmaps and image), poses, shapes, joints2d, zrot
+    return [tf.float16 if compact else tf.float32] + [tf.float32] * 4
+
+
+def read_maps_poses_images_surreal(maps_file, info_file, frames_path,
+                                   compact=False):
+    # Work out which frames are used from the small mask and diffs arrays
+    # first, then only decode and copy the frames that are kept
+    keep = usable_frame_indices(load_mask_surreal(maps_file))
+    if len(keep) == 0:
+        return empty_example_surreal(compact)
+
+    heatmaps, _ = load_maps_surreal(maps_file, keep)
+    img_size_x = heatmaps.shape[2]
+    poses, shapes, joints2d, zrot = load_info_surreal(
+        info_file, img_size_x, keep)
+    frames = load_frames_surreal(frames_path, keep)
+
+    concat = concat_heatmaps_frames(heatmaps, frames, compact)
+
+    return concat, poses, shapes, joints2d.astype(np.float32), zrot
+
+
+def empty_example_surreal(compact=False):
+    img_h, img_w = config.input_img_size
+    concat_type = np.float16 if compact else np.float32
+    return (np.zeros([0, img_h, img_w, config.n_joints + 3], concat_type),
+            np.zeros([0, 72], np.float32), np.zeros([0, 10], np.float32),
+            np.zeros([0, 24, 2], np.float32), np.zeros([0], np.float32))
+
+
+def read_shards_surreal(shards, rows, compact=False):
+    heatmaps, frames, poses, shapes, joints2d, zrot = shards.read_rows(rows)
+    concat = concat_heatmaps_frames(heatmaps, frames, compact)
+    return concat, poses, shapes, joints2d, zrot
+
+
+def concat_heatmaps_frames(heatmaps, frames, compact=False):
+    if compact:
+        # float16 represents the uint8 pixel values exactly
+        return np.concatenate([heatmaps.astype(np.float16),
+                               frames.astype(np.float16)], axis=3)
+    return np.concatenate([heatmaps.astype(np.float32),
+                           normalize_frames(frames)], axis=3)
+
+
+def usable_frame_indices(mask):
+    # Only take every n-th frame with a usable detection
+    return np.flatnonzero(mask)[::config.frame_skip]
+
+
+def load_mask_surreal(maps_file):
+    # Only reads the mask and diffs - skips over the heatmaps in the file
+    maps_dict = scipy.io.loadmat(_to_str(maps_file),
+                                 variable_names=['mask', 'diffs'])
+    return usable_frames_mask(maps_dict['mask'], maps_dict['diffs'])
+
+
+def load_maps_surreal(maps_file, frame_indices=None):
+    """ Read heatmaps flipped and reordered to match the SURREAL images, and
+    the mask of frames with a usable OpenPose detection. If frame_indices is
+    given, only those frames of the heatmaps are returned. """
+    # Skip decompressing anything else stored in the file, e.g. PAFs
+    maps_dict = scipy.io.loadmat(
+        _to_str(maps_file),
+        variable_names=['heat_mat', 'heat_mat_range', 'mask', 'diffs'])
+    heatmaps = maps_dict['heat_mat']
+    if frame_indices is not None:
+        heatmaps = heatmaps[:, :, :, frame_indices]
     # to shape: time, height, width, n_joints
-    heatmaps = np.transpose(maps_dict['heat_mat'], (3, 0, 1, 2))
-    mask = np.squeeze(maps_dict['mask'])
-    diffs = np.squeeze(maps_dict['diffs'])
-    # diffs can contain NaNs but the '<' op should exclude them
-    np.logical_and(mask, diffs < 250, out=mask)
+    heatmaps = np.transpose(heatmaps, (3, 0, 1, 2))
+    mask = usable_frames_mask(maps_dict['mask'], maps_dict['diffs'])
     # Flip heatmap horizontally because image and 3D GT are flipped in SURREAL
     heatmaps = np.flip(heatmaps, axis=2)
-    # Reorder heatmaps - swap lefts and rights for same reason (see config.py)
-    reord = [0, 1, 5, 6, 7, 2, 3, 4, 11, 12, 13, 8, 9, 10, 15, 14, 17, 16, 18]
-    heatmaps = heatmaps[:, :, :, reord]
-    heatmaps = heatmaps[:, :, :, :config.n_joints]
-    img_size_x = heatmaps.shape[2]
+    # Files compacted by compact_maps.py only have the first n_joints
+    heatmaps = heatmaps[:, :, :, _reord[:config.n_joints]]
+    if 'heat_mat_range' in maps_dict:
+        heatmaps = dequantize_heatmaps(heatmaps, maps_dict['heat_mat_range'])
+    return heatmaps, mask
 
-    info_dict = scipy.io.loadmat(info_file)
+
+def quantize_heatmaps(heatmaps):
+    # Store heatmaps as uint8 over their range of values
+    lo, hi = np.amin(heatmaps), np.amax(heatmaps)
+    scale = 255 / (hi - lo) if hi > lo else 0.0
+    quantized = np.rint((heatmaps - lo) * scale).astype(np.uint8)
+    return quantized, np.array([lo, hi], dtype=np.float32)
+
+
+def dequantize_heatmaps(heatmaps, heat_range):
+    lo, hi = np.squeeze(heat_range).astype(np.float32)
+    return heatmaps.astype(np.float32) * ((hi - lo) / 255) + lo
+
+
+def usable_frames_mask(mask, diffs):
+    mask = np.squeeze(mask).astype(bool)
+    diffs = np.squeeze(diffs)
+    # diffs can contain NaNs but the '<' op should exclude them
+    with np.errstate(invalid='ignore'):
+        np.logical_and(mask, diffs < config.max_detection_diff, out=mask)
+    return mask
+
+
+def load_info_surreal(info_file, img_size_x, frame_indices=None):
+    info_dict = scipy.io.loadmat(_to_str(info_file))
     # in mat file - pose: [72xT], shape: [10xT], joints2D: [2x24xT]
     # reshape to T as axis 0
     poses = np.transpose(info_dict['pose'], (1, 0))
     shapes = np.transpose(info_dict['shape'], (1, 0))
     # to shape: time, joints, (x, y)
     joints2d = np.transpose(info_dict['joints2D'], (2, 1, 0))
+    zrot = np.atleast_1d(np.squeeze(np.array(info_dict['zrot'])))
+    if frame_indices is not None:
+        poses, shapes, joints2d, zrot = (
+            poses[frame_indices], shapes[frame_indices],
+            joints2d[frame_indices], zrot[frame_indices])
     # Flip 2D GT horizontally because image and 3D GT are flipped in SURREAL
     joints2d[:, :, 0] = img_size_x - joints2d[:, :, 0]
-    zrot = np.squeeze(np.array(info_dict['zrot']))
-
-    # Make sure to sort the frames: VERY IMPORTANT!
-    frames = [ cv2.cvtColor(cv2.imread(f.decode('utf-8')), cv2.COLOR_BGR2RGB)
-               for f in sorted(glob.glob(frames_path + b'/f*.jpg')) ]
-    frames = np.array(frames, dtype=np.float32)
-    frames = [ cv2.normalize(frame, None, 0, 1, cv2.NORM_MINMAX)
-               for frame in frames ]
+    return poses, shapes, joints2d, zrot
+
+
+def load_frames_surreal(frames_path, frame_indices=None):
+    """ Read the RGB frames of one clip as uint8, flipped horizontally, from
+    either a directory of JPEG frames or the clip's video. If frame_indices
+    is given, only those frames are decoded. """
+    frames_path = _to_str(frames_path)
+    if os.path.isfile(frames_path):
+        frames = read_video_frames(frames_path, frame_indices)
+    else:
+        # Make sure to sort the frames: VERY IMPORTANT!
+        frames_files = sorted(glob.glob(frames_path + '/f*.jpg'))
+        if frame_indices is not None:
+            frames_files = [ frames_files[i] for i in frame_indices ]
+        frames = [ cv2.cvtColor(cv2.imread(f), cv2.COLOR_BGR2RGB)
+                   for f in frames_files ]
+        frames = np.array(frames, dtype=np.uint8)
     # Flip image horizontally because image and 3D GT are flipped in SURREAL
-    frames = np.flip(frames, axis=2)
+    return np.flip(frames, axis=2)
 
-    concat = np.concatenate([heatmaps, frames], axis=3)
 
-    concat, poses, shapes, joints2d, zrot = (
-        concat[mask], poses[mask], shapes[mask], joints2d[mask], zrot[mask])
+def frames_path_surreal(maps_file):
+    """ Directory of extracted JPEG frames for a clip if it exists,
+    otherwise the clip's video """
+    basename = maps_file[:-len('_maps.mat')]
+    if os.path.isdir(basename + '_frames'):
+        return basename + '_frames'
+    return basename + '.mp4'
 
-    skip = 2  # Only take every n-th frame
-    concat, poses, shapes, joints2d, zrot = (
-        concat[::skip], poses[::skip], shapes[::skip], joints2d[::skip],
-        zrot[::skip])
 
-    return concat, poses, shapes, joints2d.astype(np.float32), zrot
+def normalize_frames(frames):
+    # Same as cv2.normalize(frame, None, 0, 1, cv2.NORM_MINMAX) on each frame
+    frames = frames.astype(np.float32)
+    mins = np.amin(frames, axis=(1, 2, 3), keepdims=True)
+    ranges = np.amax(frames, axis=(1, 2, 3), keepdims=True) - mins
+    scale = np.divide(1.0, ranges, out=np.zeros_like(ranges),
+                      where=ranges > 0)
+    frames -= mins
+    frames *= scale
+    return frames
+
+
+def load_bad_files(report_path):
+    """ Set of maps files reported as bad by applications/validate_data.py,
+    or an empty set if there is no report """
+    try:
+        with open(report_path) as f:
+            report = json.load(f)
+    except FileNotFoundError:
+        return set()
+    return set(bad['maps_file'] for bad in report['bad'])
+
+
+def _to_str(path):
+    # tf.py_func passes strings in as bytes
+    return path.decode('utf-8') if isinstance(path, bytes) else path
 
 
 def read_tfrecord_h36m(record):
@@ -119,9 +331,11 @@ def read_tfrecord_h36m(record):
 
 def read_maps_h36m(maps_file):
     # These are the heatmaps generated using predict_h36m_tfrecords.py
-    maps_dict = scipy.io.loadmat(maps_file)
+    maps_dict = scipy.io.loadmat(_to_str(maps_file))
     heatmaps = np.transpose(maps_dict['heat_mat'], (3, 0, 1, 2))
     heatmaps = heatmaps[:, :, :, :config.n_joints]
+    if 'heat_mat_range' in maps_dict:
+        heatmaps = dequantize_heatmaps(heatmaps, maps_dict['heat_mat_range'])
     return heatmaps
 
 
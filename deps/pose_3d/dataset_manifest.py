@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import json
+import zlib
+import multiprocessing
+
+import scipy.io
+from scipy.io.matlab import MatReadError
+
+from . import config
+from . import data_helpers
+
+
+MANIFEST_FILENAME = 'dataset_manifest.json'
+
+
+def load_manifest(dataset_dir, manifest_path=None, refresh=True,
+                  n_workers=None):
+    """ Manifest of the SURREAL clips in dataset_dir (one run directory),
+    with their files, frame counts and subject/sequence. It is cached in
+    manifest_path and, if refresh, only directories whose mtime changed since
+    it was written are rescanned. With refresh=False the cached manifest is
+    used as is if there is one. """
+    dataset_dir = os.path.realpath(dataset_dir)
+    if manifest_path is None:
+        manifest_path = os.path.join(dataset_dir, MANIFEST_FILENAME)
+    frame_selection = [config.max_detection_diff, config.frame_skip]
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['frame_selection'] != frame_selection:
+            manifest = None  # usable frame counts are out of date
+    except (OSError, ValueError):
+        manifest = None
+    if manifest is not None and not refresh:
+        return manifest
+    old_dirs = manifest['dirs'] if manifest is not None else {}
+
+    dirs = {}
+    to_scan = []
+    for basename in sorted(os.listdir(dataset_dir)):
+        dir_path = os.path.join(dataset_dir, basename)
+        if not os.path.isdir(dir_path):
+            continue
+        mtime = os.stat(dir_path).st_mtime_ns
+        old_dir = old_dirs.get(basename)
+        if old_dir is not None and old_dir['mtime_ns'] == mtime:
+            dirs[basename] = old_dir
+        else:
+            to_scan.append((dir_path, basename, mtime, old_dir))
+
+    if to_scan or set(dirs) != set(old_dirs):
+        if to_scan:
+            with multiprocessing.Pool(n_workers) as pool:
+                for basename, one_dir in pool.imap_unordered(_scan_dir,
+                                                             to_scan):
+                    dirs[basename] = one_dir
+        manifest = {'dataset': dataset_dir,
+                    'frame_selection': frame_selection,
+                    'dirs': dict(sorted(dirs.items()))}
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def _scan_dir(args):
+    dir_path, basename, mtime, old_dir = args
+    old_clips = {}
+    if old_dir is not None:
+        old_clips = {clip['maps_file']: clip for clip in old_dir['clips']}
+    clips = []
+    for maps_file in sorted(glob.glob(
+            os.path.join(dir_path, basename + '_c*_maps.mat'))):
+        maps_mtime = os.stat(maps_file).st_mtime_ns
+        clip = old_clips.get(maps_file)
+        if clip is None or clip['maps_mtime_ns'] != maps_mtime:
+            clip = _clip_entry(maps_file, basename)
+            clip['maps_mtime_ns'] = maps_mtime
+        # frames may have been extracted or removed since
+        clip['frames_path'] = data_helpers.frames_path_surreal(maps_file)
+        clips.append(clip)
+    return basename, {'mtime_ns': mtime, 'clips': clips}
+
+
+def _clip_entry(maps_file, basename):
+    info_file = maps_file[:-len('_maps.mat')] + '_info.mat'
+    # SURREAL CMU directories are named <subject>_<sequence>
+    subject, _, sequence = basename.partition('_')
+    clip = {'maps_file': maps_file,
+            'info_file': info_file,
+            'subject': subject,
+            'sequence': sequence,
+            'clip': maps_file[:-len('_maps.mat')].rsplit('_', 1)[-1]}
+    try:
+        for name, shape, _ in scipy.io.whosmat(info_file):
+            if name == 'pose':  # pose: [72xT]
+                clip['n_frames'] = shape[1]
+        if 'n_frames' not in clip:
+            raise ValueError("No pose in {}".format(info_file))
+        mask = data_helpers.load_mask_surreal(maps_file)
+    except (OSError, ValueError, KeyError, MatReadError, zlib.error) as e:
+        # Including empty or truncated files (MatReadError, zlib.error).
+        # Recorded so it is not rescanned; left for validate_data.py
+        clip['error'] = str(e)
+        return clip
+    clip['n_masked'] = int(mask.sum())
+    clip['n_usable'] = len(data_helpers.usable_frame_indices(mask))
+    return clip
+
+
+def manifest_clips(manifest, exclude=(), include_errors=False):
+    """ List of clip entries, without the clips whose maps file is in
+    exclude (e.g. data_helpers.load_bad_files) and, unless include_errors,
+    clips which could not be read """
+    exclude = set(exclude)
+    return [ clip for one_dir in manifest['dirs'].values()
+             for clip in one_dir['clips']
+             if clip['maps_file'] not in exclude and
+             (include_errors or 'error' not in clip) ]
+
+
+def clip_files(clips):
+    """ maps_files, info_files, frames_paths lists for the clips """
+    return ([ clip['maps_file'] for clip in clips ],
+            [ clip['info_file'] for clip in clips ],
+            [ clip['frames_path'] for clip in clips ])
+
+
+def n_usable_frames(clips):
+    return sum(clip['n_usable'] for clip in clips)
+
+
+def shard_clips_balanced(clips, n_shards: int):
+    """ Split clips into n_shards lists with close to equal numbers of usable
+    frames (greedily assigns the longest clips first) """
+    shards = [ [] for _ in range(n_shards) ]
+    shard_frames = [0] * n_shards
+    for clip in sorted(clips, key=lambda c: c['n_usable'], reverse=True):
+        idx = shard_frames.index(min(shard_frames))
+        shards[idx].append(clip)
+        shard_frames[idx] += clip['n_usable']
+    return shards
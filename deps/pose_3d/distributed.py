@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+import tensorflow as tf
+
+
+def local_cluster(n_workers: int, n_ps=1, host='localhost', base_port=2222):
+    """ ClusterSpec for between-graph replicated training with all tasks on
+    this machine, on consecutive ports from base_port. Worker 0 is the chief
+    """
+    ports = iter(range(base_port, base_port + n_ps + n_workers))
+    return tf.train.ClusterSpec({
+        'ps': [ '{}:{}'.format(host, next(ports)) for _ in range(n_ps) ],
+        'worker': [ '{}:{}'.format(host, next(ports))
+                    for _ in range(n_workers) ]})
+
+
+def start_server(cluster, job_name: str, task_index: int):
+    """ Start the in-process server for one task of the cluster. Since all
+    the workers share one node, each gets an equal share of its cores for
+    its op thread pools, rather than every worker using all of them """
+    cluster = tf.train.ClusterSpec(cluster)
+    if job_name == 'ps':
+        n_threads = 2
+    else:
+        n_threads = max(1, os.cpu_count() // cluster.num_tasks('worker'))
+    config = tf.ConfigProto(intra_op_parallelism_threads=n_threads,
+                            inter_op_parallelism_threads=n_threads)
+    return tf.train.Server(cluster, job_name=job_name, task_index=task_index,
+                           config=config)
+
+
+def session_config(server):
+    """ Session config for a worker: it only needs to reach the parameter
+    servers and itself, so it does not wait for the other workers to start
+    """
+    return tf.ConfigProto(device_filters=[
+        '/job:ps', '/job:worker/task:{}'.format(server.server_def.task_index)])
+
+
+def wait_for_variables(sess, poll_secs=1.0):
+    """ Block until the chief has initialised or restored all the global
+    variables. Local variables are each worker's own to initialise """
+    uninitialized = tf.report_uninitialized_variables(tf.global_variables())
+    while len(sess.run(uninitialized)) > 0:
+        time.sleep(poll_secs)
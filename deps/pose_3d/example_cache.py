@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import hashlib
+import threading
+
+import numpy as np
+
+
+class ExampleCache:
+    """ Persistent on-disk cache of preprocessed examples (tuples of numpy
+    arrays). Entries are keyed on the path, mtime and size of their source
+    files, so they are invalidated when the sources change. When the cache
+    grows over max_bytes, the least recently used entries are removed. """
+    def __init__(self, cache_dir, max_bytes=200 * 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.n_write_errors = 0
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.npz')):
+            try:
+                st = os.stat(path)
+            except OSError:  # removed by another reader
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def key(self, source_paths, *params):
+        """ Key for the entry computed from source_paths with params """
+        h = hashlib.sha1()
+        for path in source_paths:
+            path = path.decode('utf-8') if isinstance(path, bytes) else path
+            st = os.stat(path)
+            h.update('{}:{}:{}\n'.format(
+                os.path.realpath(path), st.st_mtime_ns, st.st_size).encode())
+        h.update(repr(params).encode())
+        return h.hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                example = tuple(data['arr_{}'.format(i)]
+                                for i in range(len(data.files)))
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError, KeyError):
+            return None
+        return example
+
+    def put(self, key: str, example):
+        """ Store example under key. A failed write (e.g. disk full) only
+        leaves it uncached, and is counted in n_write_errors """
+        path = self._path(key)
+        # Write to a temporary file first so readers never see partial files
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(),
+                                         threading.get_ident())
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, *example)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            with self._lock:
+                self.n_write_errors += 1
+            return
+        with self._lock:
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Remove least recently used entries until at 90% of the budget
+        entries = sorted(self._entries())
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._total_bytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._total_bytes -= size
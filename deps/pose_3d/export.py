@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import json
+import collections
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+
+def _transforms(input_shape):
+    shape = ','.join(str(-1 if d is None else d) for d in input_shape)
+    return [
+        # Also replaces the estimate_stream iterator feeding the input with
+        # a plain placeholder
+        'strip_unused_nodes(type=float, shape="{}")'.format(shape),
+        'remove_nodes(op=Identity, op=CheckNumerics)',
+        'fold_constants(ignore_errors=true)',
+        'fold_batch_norms',
+        'fold_old_batch_norms',
+    ]
+
+
+FINAL_TRANSFORMS = ['fold_constants(ignore_errors=true)',
+                    'strip_unused_nodes', 'sort_by_execution_order']
+
+FUSED_BATCH_NORM_OPS = ('FusedBatchNorm', 'FusedBatchNormV2',
+                        'FusedBatchNormV3')
+
+
+def freeze_inference_graph(sess, inputs, outputs):
+    """ Inference-only GraphDef computing outputs from inputs, with the
+    variables as constants, check_numerics and summaries removed, constant
+    subgraphs (e.g. the blur kernel) folded, and batch norm folded into the
+    weights of the preceding conv or dense layer """
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        sess, sess.graph.as_graph_def(), [outputs.op.name])
+    in_names, out_names = [inputs.op.name], [outputs.op.name]
+    graph_def = TransformGraph(graph_def, in_names, out_names,
+                               _transforms(inputs.shape.as_list()))
+    # fold_batch_norms and fold_old_batch_norms only match a batch norm
+    # directly after the conv or matmul, but the layers here have a bias add
+    # in between
+    graph_def = _fold_biased_batch_norms(graph_def, out_names)
+    return TransformGraph(graph_def, in_names, out_names, FINAL_TRANSFORMS)
+
+
+def _const_value(node):
+    return tf.make_ndarray(node.attr['value'].tensor)
+
+
+def _set_const_value(node, value):
+    node.attr['value'].CopyFrom(tf.AttrValue(
+        tensor=tf.make_tensor_proto(value.astype(np.float32))))
+
+
+def _fold_biased_batch_norms(graph_def, output_names):
+    # Inference batch norm is x * scale + offset: after constant folding an
+    # explicit Mul and Add for the dense layers, and a FusedBatchNorm with
+    # scale = gamma * rsqrt(variance + epsilon) for the convs. Rewrites
+    #   Add(Mul(BiasAdd(MatMul|Conv2D(x, W), b), scale), offset) and
+    #   FusedBatchNorm([BiasAdd](Conv2D|DepthwiseConv2dNative(x, W), b), ...)
+    # as BiasAdd(op(x, W * scale), b * scale + offset), scaling the output
+    # channels, when each intermediate result has no other consumer
+    nodes = { n.name: n for n in graph_def.node }
+    consumers = collections.defaultdict(list)
+    for node in graph_def.node:
+        for name in node.input:
+            consumers[name.split(':')[0].lstrip('^')].append(node)
+
+    def only_consumer_is(name, node):
+        return [ c.name for c in consumers[name] ] == [node.name]
+
+    def single_const_input(node):
+        consts = [ nodes.get(name) for name in node.input
+                   if name in nodes and nodes[name].op == 'Const' ]
+        others = [ name for name in node.input
+                   if name not in nodes or nodes[name].op != 'Const' ]
+        if len(consts) == 1 and len(others) == 1:
+            return consts[0], others[0]
+        return None, None
+
+    removed = {}  # folded node name -> name of the node replacing it
+    for mul in list(graph_def.node):
+        if mul.op != 'Mul':
+            continue
+        scale, bias_add_name = single_const_input(mul)
+        bias_add = nodes.get(bias_add_name)
+        if (scale is None or bias_add is None or bias_add.op != 'BiasAdd' or
+                len(consumers[bias_add.name]) != 1 or
+                bias_add_name in output_names):
+            continue
+        linear, bias = [ nodes.get(name) for name in bias_add.input ]
+        if (linear is None or bias is None or bias.op != 'Const' or
+                linear.op not in ('MatMul', 'Conv2D') or
+                linear.attr['transpose_b'].b or
+                len(consumers[linear.name]) != 1 or
+                nodes.get(linear.input[1]) is None or
+                nodes[linear.input[1]].op != 'Const' or
+                len(consumers[linear.input[1]]) != 1 or
+                len(consumers[bias.name]) != 1):
+            continue
+        scale_value = _const_value(scale)
+        n_out = _const_value(bias).shape[0]
+        if scale_value.size not in (1, n_out):
+            continue
+        scale_value = scale_value.reshape(-1)
+        weights = nodes[linear.input[1]]
+        _set_const_value(weights, _const_value(weights) * scale_value)
+        bias_value = _const_value(bias) * scale_value
+        removed[mul.name] = bias_add.name
+
+        add_consumers = consumers[mul.name]
+        if len(add_consumers) == 1 and add_consumers[0].op in ('Add', 'AddV2'):
+            add = add_consumers[0]
+            offset, _ = single_const_input(add)
+            if (offset is not None and add.name not in output_names and
+                    _const_value(offset).size in (1, n_out)):
+                bias_value = bias_value + _const_value(offset).reshape(-1)
+                removed[add.name] = bias_add.name
+        _set_const_value(bias, bias_value)
+
+    for bn in list(graph_def.node):
+        if (bn.op not in FUSED_BATCH_NORM_OPS or bn.name in output_names or
+                bn.attr['is_training'].b or
+                bn.attr['data_format'].s not in (b'', b'NHWC')):
+            continue
+        # Only the normalised output may be used
+        if any(name.split(':')[0] == bn.name and name not in
+               (bn.name, bn.name + ':0')
+               for c in consumers[bn.name] for name in c.input):
+            continue
+        params = [ nodes.get(name) for name in bn.input[1:5] ]
+        if any(p is None or p.op != 'Const' for p in params):
+            continue
+        linear, bias = nodes.get(bn.input[0]), None
+        if (linear is not None and linear.op == 'BiasAdd' and
+                only_consumer_is(linear.name, bn) and
+                nodes.get(linear.input[1]) is not None and
+                nodes[linear.input[1]].op == 'Const' and
+                only_consumer_is(linear.input[1], linear)):
+            bias_add, bias = linear, nodes[linear.input[1]]
+            linear = nodes.get(bias_add.input[0])
+        else:
+            bias_add = None
+        if (linear is None or
+                linear.op not in ('Conv2D', 'DepthwiseConv2dNative') or
+                linear.attr['data_format'].s not in (b'', b'NHWC') or
+                not only_consumer_is(linear.name,
+                                     bn if bias_add is None else bias_add) or
+                nodes.get(linear.input[1]) is None or
+                nodes[linear.input[1]].op != 'Const' or
+                not only_consumer_is(linear.input[1], linear)):
+            continue
+        gamma, beta, mean, variance = [ _const_value(p) for p in params ]
+        scale = gamma / np.sqrt(variance + bn.attr['epsilon'].f)
+        weights = nodes[linear.input[1]]
+        weights_value = _const_value(weights)
+        if linear.op == 'DepthwiseConv2dNative':
+            # Output channel in * multiplier + m of [h, w, in, multiplier]
+            _set_const_value(weights, weights_value *
+                             scale.reshape(weights_value.shape[2:]))
+        else:
+            _set_const_value(weights, weights_value * scale)
+        bias_value = beta - mean * scale
+        if bias is not None:
+            bias_value = bias_value + _const_value(bias) * scale
+            removed[bias_add.name] = linear.name
+        else:
+            bias = graph_def.node.add()
+            bias.op = 'Const'
+            bias.name = bn.name + '/folded_bias'
+            bias.attr['dtype'].type = tf.float32.as_datatype_enum
+        _set_const_value(bias, bias_value)
+
+        # The batch norm node becomes the bias add, so its consumers need
+        # no rewiring
+        dtype = bn.attr['T'].type
+        bn.op = 'BiasAdd'
+        bn.ClearField('attr')
+        bn.attr['T'].type = dtype
+        bn.attr['data_format'].s = b'NHWC'
+        del bn.input[:]
+        bn.input.extend([linear.name, bias.name])
+
+    for node in graph_def.node:
+        for i, name in enumerate(node.input):
+            while name in removed:
+                name = removed[name]
+            node.input[i] = name
+    kept = [ n for n in graph_def.node if n.name not in removed ]
+    del graph_def.node[:]
+    graph_def.node.extend(kept)
+    return graph_def
+
+
+def write_frozen_graph(graph_def, path, inputs, outputs):
+    """ Write the GraphDef to path, and the input and output tensor names
+    to path.json for FrozenPoseModel """
+    with open(path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(path + '.json', 'w') as f:
+        json.dump({'input': inputs.name, 'output': outputs.name,
+                   'input_shape': inputs.shape.as_list()}, f)
+
+
+def op_counts(graph_def):
+    """ Number of nodes of each op type, to compare graphs """
+    return collections.Counter(n.op for n in graph_def.node)
+
+
+class FrozenPoseModel:
+    """ Runs a graph written by PoseModel3d.export_inference_graph, with
+    the same estimate() as PoseModel3d in 'test' mode """
+    def __init__(self, path, session_config=None):
+        with open(path + '.json') as f:
+            names = json.load(f)
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.graph.finalize()
+        self.in_placeholder = self.graph.get_tensor_by_name(names['input'])
+        self.outputs = self.graph.get_tensor_by_name(names['output'])
+        self.sess = tf.Session(graph=self.graph, config=session_config)
+
+    def estimate(self, input_inst):
+        """ Run the model on an input instance """
+        return self.sess.run(self.outputs,
+                             feed_dict={self.in_placeholder: input_inst})
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.io
+import cv2
+
+import tf_pose.common
+from tf_pose.estimator import PoseEstimator
+
+
+def inference_batch(estimator, images, upsample_size=4.0):
+    """ Batched version of TfPoseEstimator.inference with
+    resize_to_default=True. Runs one OpenPose forward pass for all images.
+    Returns a list of (humans, heatMat) for each image """
+    target_w, target_h = estimator.target_size
+    scaled = [ cv2.resize(img, (target_w, target_h),
+                          interpolation=cv2.INTER_CUBIC)
+               if img.shape[:2] != (target_h, target_w) else img
+               for img in images ]
+    upsample = [int(target_h / 8 * upsample_size),
+                int(target_w / 8 * upsample_size)]
+    peaks, heat_mats, paf_mats = estimator.persistent_sess.run(
+        [estimator.tensor_peaks, estimator.tensor_heatMat_up,
+         estimator.tensor_pafMat_up],
+        feed_dict={estimator.tensor_image: scaled,
+                   estimator.upsample_size: upsample})
+    return [ (PoseEstimator.estimate_paf(peak, heat_mat, paf_mat), heat_mat)
+             for peak, heat_mat, paf_mat in zip(peaks, heat_mats, paf_mats) ]
+
+
+def summarise_detection(humans, joints2d):
+    """ Detected 2D joints and whether the detection is usable for training,
+    with the distance between the detected and ground truth centres """
+    if len(humans) == 0:
+        usable = False
+        human = np.zeros([14, 2], dtype=np.float32)
+        visibility = np.zeros([14], dtype=bool)
+    else:
+        usable = len(humans) == 1
+        human, visibility = tf_pose.common.MPIIPart.from_coco(humans[0])
+        human = np.array(human)
+        visibility = np.array(visibility)
+    avg_location = np.mean(human[visibility], axis=0)
+    avg_joint2d = np.mean(joints2d, axis=0)
+    diff = np.linalg.norm(avg_location - avg_joint2d)
+    return usable, human, visibility, diff
+
+
+def prefetch_batches(load_fn, items, batch_size: int, n_threads=4):
+    """ Yield batches of load_fn(item) in order. The next batch is loaded by
+    background threads while the current batch is being processed """
+    items = list(items)
+    with ThreadPoolExecutor(n_threads) as executor:
+        def submit(start):
+            return [ executor.submit(load_fn, item)
+                     for item in items[start:start + batch_size] ]
+
+        pending = submit(0)
+        for start in range(0, len(items), batch_size):
+            batch = pending
+            pending = submit(start + batch_size)
+            yield [ f.result() for f in batch ]
+
+
+def background_batches(frames, batch_size: int, max_pending=2):
+    """ Yield lists of batch_size frames from the iterable frames, e.g. a
+    video decoded sequentially, which is consumed by a background thread.
+    Frames are copied, so the iterable can reuse its buffers. An exception
+    raised by the iterable is re-raised here. Once the generator is closed
+    or stops early the thread is stopped and joined, so the iterable is no
+    longer in use and can be closed """
+    batches = queue.Queue(max_pending)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up if the consumer has gone
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        batch = []
+        try:
+            for frame in frames:
+                batch.append(np.copy(frame))
+                if len(batch) == batch_size:
+                    if not put((batch, None)):
+                        return
+                    batch = []
+            if batch and not put((batch, None)):
+                return
+            put((None, None))
+        except Exception as e:  # pylint: disable=broad-except
+            put((None, e))
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch, error = batches.get()
+            if error is not None:
+                raise error
+            if batch is None:
+                return
+            yield batch
+    finally:
+        stop.set()
+        thread.join()
+
+
+class HeatmapFile:
+    """ Streams the heatmaps of one clip to a scratch file on disk as they
+    are generated, instead of holding every frame in memory until the clip
+    is saved. The scratch array is laid out so that it is already in the
+    (height, width, channels, time) Fortran order that savemat writes.
+    n_frames is the initial capacity, which is doubled when it runs out """
+    def __init__(self, path, heat_shape, n_frames=64):
+        self.path = path
+        h, w, c = heat_shape
+        self._frame_shape = (c, w, h)
+        self._array = np.memmap(path, mode='w+', dtype=np.float32,
+                                shape=(max(n_frames, 1),) + self._frame_shape)
+        self._next = 0
+
+    def append(self, heat_mats):
+        for heat_mat in heat_mats:
+            if self._next == len(self._array):
+                self._grow()
+            self._array[self._next] = np.transpose(heat_mat, (2, 1, 0))
+            self._next += 1
+
+    def _grow(self):
+        # Opening r+ with a larger shape extends the file in place
+        n_frames = 2 * len(self._array)
+        self._array.flush()
+        del self._array
+        self._array = np.memmap(self.path, mode='r+', dtype=np.float32,
+                                shape=(n_frames,) + self._frame_shape)
+
+    def heat_mat(self):
+        """ All heatmaps with shape (height, width, channels, time) """
+        self._array.flush()
+        return np.transpose(self._array[:self._next], (3, 2, 1, 0))
+
+    def remove(self):
+        del self._array
+        os.remove(self.path)
+
+
+def save_maps(out_mat_filename, heat_mat, mask, diffs, humans, visibilities):
+    # Stacking on last axis makes .mat file smaller compared to first axis
+    out_dict = {}
+    out_dict['mask'] = np.array(mask)
+    out_dict['diffs'] = np.array(diffs)
+    out_dict['detected_2D'] = np.stack(humans, axis=-1)
+    out_dict['visibility_2D'] = np.stack(visibilities, axis=-1)
+    out_dict['heat_mat'] = heat_mat
+    scipy.io.savemat(out_mat_filename, out_dict,
+                     do_compression=True, appendmat=True)
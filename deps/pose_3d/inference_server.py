@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import time
+import queue
+import socket
+import threading
+import collections
+import http.client
+import http.server
+import socketserver
+
+import numpy as np
+
+
+class _Request:
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.outputs = None
+        self.error = None
+
+
+class DynamicBatcher:
+    """ Groups concurrent requests into batches for one estimate_fn (e.g.
+    PoseModel3d.estimate) run by a single worker thread. A batch is run once
+    it has max_batch_size examples or its first request has waited
+    max_latency_ms for others, whichever comes first. Requests are arrays of
+    one or more examples along the first axis, each of example_shape (the
+    model input shape without the batch axis), which is checked before they
+    are queued so a bad request cannot fail the batch it would be run in.
+    Keeps the batch sizes and request latencies (arrival to result) of the
+    last n_recent requests for stats() """
+    def __init__(self, estimate_fn, example_shape, max_batch_size=32,
+                 max_latency_ms=10.0, n_recent=10000):
+        self.estimate_fn = estimate_fn
+        self.example_shape = tuple(example_shape)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self._queue = queue.Queue()
+        self._carry = []  # request which did not fit in the last batch
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=n_recent)
+        self._batch_sizes = collections.deque(maxlen=n_recent)
+        self._n_requests = 0
+        self._n_errors = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def estimate(self, inputs, timeout=None):
+        """ Outputs for inputs, run as part of a batch. Blocks until done.
+        Raises ValueError if inputs are not a batch of examples of the
+        model's input shape """
+        inputs = np.asarray(inputs, dtype=np.float32)
+        if (inputs.ndim != len(self.example_shape) + 1 or
+                inputs.shape[1:] != self.example_shape or
+                len(inputs) == 0):
+            raise ValueError(
+                "Expected inputs of shape (batch, {}), got {}".format(
+                    ', '.join(map(str, self.example_shape)), inputs.shape))
+        request = _Request(inputs)
+        self._queue.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError("No result after {} s".format(timeout))
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def close(self):
+        """ Finish the queued requests and stop the worker thread """
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            latencies_ms = 1000 * np.array(self._latencies)
+            batch_sizes = np.array(self._batch_sizes)
+            stats = {'queue_depth': self._queue.qsize(),
+                     'requests': self._n_requests,
+                     'errors': self._n_errors}
+        if len(batch_sizes):
+            stats['mean_batch_size'] = float(batch_sizes.mean())
+            stats['max_batch_size'] = int(batch_sizes.max())
+        if len(latencies_ms):
+            stats['p50_ms'] = float(np.percentile(latencies_ms, 50))
+            stats['p99_ms'] = float(np.percentile(latencies_ms, 99))
+        return stats
+
+    def _next_batch(self):
+        # The first request blocks indefinitely, the rest until its deadline.
+        # Returns None once closed and drained
+        first = self._carry.pop() if self._carry else self._queue.get()
+        if first is None:
+            return None
+        batch, n_examples = [first], len(first.inputs)
+        deadline = first.arrival + self.max_latency
+        while n_examples < self.max_batch_size:
+            try:
+                request = self._queue.get(
+                    timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if (request is None or
+                    n_examples + len(request.inputs) > self.max_batch_size):
+                self._carry.append(request)
+                break
+            batch.append(request)
+            n_examples += len(request.inputs)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                outputs = self.estimate_fn(
+                    np.concatenate([ r.inputs for r in batch ]))
+                splits = np.cumsum([ len(r.inputs) for r in batch ])[:-1]
+                for request, out in zip(batch, np.split(outputs, splits)):
+                    request.outputs = out
+            except Exception as e:  # pylint: disable=broad-except
+                for request in batch:
+                    request.error = e
+            now = time.perf_counter()
+            with self._lock:
+                self._batch_sizes.append(
+                    sum(len(r.inputs) for r in batch))
+                self._n_requests += len(batch)
+                for request in batch:
+                    self._latencies.append(now - request.arrival)
+                    self._n_errors += request.error is not None
+            for request in batch:
+                request.done.set()
+
+
+def _to_npy(array):
+    buf = io.BytesIO()
+    np.save(buf, array, allow_pickle=False)
+    return buf.getvalue()
+
+
+def _from_npy(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # POST /estimate with an .npy array body, returns the outputs as .npy.
+    # GET /stats returns the batcher stats as JSON. Connections are kept
+    # open between requests
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.path != '/estimate':
+            self._error(404)
+            return
+        try:
+            inputs = _from_npy(
+                self.rfile.read(int(self.headers['Content-Length'])))
+            outputs = self.server.batcher.estimate(inputs)
+        except ValueError as e:
+            # Unreadable array or wrong shape
+            self._error(400, str(e))
+            return
+        except Exception as e:  # pylint: disable=broad-except
+            self._error(500, str(e))
+            return
+        self._reply(_to_npy(outputs), 'application/octet-stream')
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self._error(404)
+            return
+        self._reply(json.dumps(self.server.batcher.stats()).encode(),
+                    'application/json')
+
+    def _reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message=None):
+        # The request body may not have been read, so the connection cannot
+        # be reused
+        self.close_connection = True
+        self.send_error(code, message)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass  # one line per request would flood the console
+
+
+class _TCPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # Unix socket peers have no address, which the handler expects
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def make_server(batcher, address):
+    """ HTTP server for batcher on address: a (host, port) tuple, or the
+    path of a Unix socket. Call serve_forever() to run it """
+    if isinstance(address, str):
+        server = _UnixServer(address, _Handler)
+    else:
+        server = _TCPServer(address, _Handler)
+    server.batcher = batcher
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceClient:
+    """ Client for make_server's address. Keeps one connection open across
+    requests, so use one client per thread """
+    def __init__(self, address, timeout=60):
+        if isinstance(address, str):
+            self._conn = _UnixHTTPConnection(address, timeout)
+        else:
+            self._conn = http.client.HTTPConnection(*address, timeout=timeout)
+
+    def estimate(self, inputs):
+        return _from_npy(self._request(
+            'POST', '/estimate', _to_npy(np.asarray(inputs, np.float32))))
+
+    def stats(self):
+        return json.loads(self._request('GET', '/stats').decode())
+
+    def close(self):
+        self._conn.close()
+
+    def _request(self, method, path, body=None):
+        self._conn.request(method, path, body)
+        response = self._conn.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise RuntimeError("{} {}: {} {}".format(
+                method, path, response.status, response.reason))
+        return data
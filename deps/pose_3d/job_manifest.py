@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import fcntl
+import socket
+import hashlib
+import collections
+from contextlib import contextmanager
+
+
+def fingerprint(path):
+    """ Size, mtime and checksum of a file. For a directory, the checksum is
+    of the names, sizes and mtimes of the files in it """
+    st = os.stat(path)
+    h = hashlib.sha1()
+    if os.path.isdir(path):
+        size = 0
+        for name in sorted(os.listdir(path)):
+            f_st = os.stat(os.path.join(path, name))
+            h.update('{}:{}:{}\n'.format(
+                name, f_st.st_size, f_st.st_mtime_ns).encode())
+            size += f_st.st_size
+    else:
+        size = st.st_size
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return {'size': size, 'mtime_ns': st.st_mtime_ns, 'sha1': h.hexdigest()}
+
+
+def unchanged(path, record):
+    """ Whether path still matches a fingerprint. The checksum is only
+    recomputed if the size or mtime differ from the recorded ones """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if not os.path.isdir(path):
+        if st.st_size != record['size']:
+            return False
+        if st.st_mtime_ns == record['mtime_ns']:
+            return True
+    return fingerprint(path)['sha1'] == record['sha1']
+
+
+class JobManifest:
+    """ Records completed preprocessing jobs (e.g. one clip) with checksums
+    of their inputs and the sizes of their outputs, so reruns can skip
+    finished work and redo jobs whose inputs changed or whose outputs are
+    missing or corrupt. Several worker processes can share one manifest: a
+    job is claimed before it is started, and claims older than claim_timeout
+    seconds are treated as abandoned.
+    Claims, releases and completions are appended as JSON lines to a
+    journal next to path (<path without extension>.jsonl), which each
+    process replays incrementally, so the lock is only held to read the new
+    lines and append one. A manifest written by earlier versions as one JSON
+    file at path is read as the initial state """
+    def __init__(self, path, claim_timeout=6 * 3600):
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + '.jsonl'
+        self.claim_timeout = claim_timeout
+        self.owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self._done = {}
+        self._claims = {}
+        self._output_keys = collections.defaultdict(set)
+        self._offset = 0  # of the journal lines not yet replayed
+        self._load_legacy()
+
+    def _load_legacy(self):
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, record in manifest.get('done', {}).items():
+            self._set_done(key, record)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.journal_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        # Replay the lines appended since the last refresh. A line still
+        # being appended by another process is left for the next one
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            self._apply(json.loads(line.decode()))
+        self._offset += end
+
+    def _apply(self, entry):
+        event, key = entry['event'], entry.get('key')
+        if event == 'claim':
+            self._claims[key] = {'owner': entry['owner'],
+                                 'time': entry['time']}
+        elif event == 'release':
+            self._claims.pop(key, None)
+        elif event == 'done':
+            self._claims.pop(key, None)
+            self._set_done(key, entry['record'])
+        elif event == 'outputs':
+            for path, f_record in entry['outputs'].items():
+                for done_key in self._output_keys.get(path, ()):
+                    self._done[done_key]['outputs'][path] = f_record
+
+    def _set_done(self, key, record):
+        self._done[key] = record
+        for path in record['outputs']:
+            self._output_keys[path].add(key)
+
+    def _append(self, entry):
+        # Only called holding the lock, so lines are never interleaved
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def is_done(self, key: str):
+        self._refresh()
+        record = self._done.get(key)
+        if record is None:
+            return False
+        files = list(record['inputs'].items()) + list(
+            record['outputs'].items())
+        return all(unchanged(path, f_record) for path, f_record in files)
+
+    def claim(self, key: str):
+        """ Claim a job for this process. Returns False if the job is already
+        done or is being worked on by another process """
+        # Checked outside the lock since it can stat whole directories
+        if self.is_done(key):
+            return False
+        checked = self._done.get(key)
+        with self._locked():
+            if self._done.get(key) is not checked:
+                return False  # completed by another process meanwhile
+            claim = self._claims.get(key)
+            if (claim is not None and claim['owner'] != self.owner and
+                    time.time() - claim['time'] < self.claim_timeout):
+                return False
+            self._append({'event': 'claim', 'key': key, 'owner': self.owner,
+                          'time': time.time()})
+        return True
+
+    def release(self, key: str):
+        """ Give up a claimed job without completing it, e.g. on failure """
+        with self._locked():
+            if key in self._claims:
+                self._append({'event': 'release', 'key': key,
+                              'owner': self.owner, 'time': time.time()})
+
+    def complete(self, key: str, input_paths, output_paths):
+        # Checksum outside the lock since it reads whole files
+        record = {'inputs': {p: fingerprint(p) for p in input_paths},
+                  'outputs': {p: fingerprint(p) for p in output_paths},
+                  'owner': self.owner,
+                  'time': time.time()}
+        with self._locked():
+            self._append({'event': 'done', 'key': key, 'record': record})
+
+    def update_outputs(self, output_paths):
+        """ Refresh the recorded fingerprints of outputs which were rewritten
+        on purpose after their job completed, e.g. by compact_maps.py """
+        fingerprints = {p: fingerprint(p) for p in output_paths}
+        with self._locked():
+            self._append({'event': 'outputs', 'outputs': fingerprints,
+                          'time': time.time()})
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 
 import tensorflow as tf
-from tensorflow import keras
 
 from tf_perspective_projection.project import rodrigues_batch
 from tf_pose.common import CocoPart
@@ -10,12 +9,25 @@ from . import utils
 from . import config
 
 
-def build_model(inputs, training: bool):
-    with tf.variable_scope('encoder'):
+def build_model(inputs, training: bool, compute_dtype=tf.float32):
+    """ compute_dtype tf.float16 or tf.bfloat16 runs the convolutional and
+    dense layers in reduced precision (mixed precision). Variables are still
+    created and updated in float32, batch norm statistics are kept in
+    float32, and the input preprocessing and output layers run in float32
+    so the outputs are always float32 """
+    getter = None
+    if compute_dtype != tf.float32:
+        getter = _float32_variable_getter
+    with tf.variable_scope('encoder', custom_getter=getter):
         with tf.variable_scope("preprocess_heatmaps"):
             inputs = tf.check_numerics(inputs, "inputs not finite")
             input_rgb = inputs[:, :, :, config.n_joints:]
             input_heatmaps = inputs[:, :, :, :config.n_joints]
+            if inputs.dtype != tf.float32:
+                # Compact inputs from the data pipeline: unnormalised images
+                input_rgb = utils.normalize_minmax(
+                    tf.cast(input_rgb, tf.float32))
+                input_heatmaps = tf.cast(input_heatmaps, tf.float32)
             input_heatmaps = utils.gaussian_blur(input_heatmaps)
             inputs = tf.concat([input_heatmaps, input_rgb], axis=3)
             tf.summary.image('in_images',
@@ -23,9 +35,10 @@ def build_model(inputs, training: bool):
                              max_outputs=1)
 
         with tf.variable_scope('init_conv'):
+            inputs = tf.cast(inputs, compute_dtype)
             in_channels = inputs.get_shape().as_list()[-1]
             init_conv1 = tf.layers.conv2d(inputs, in_channels, [3, 3])
-            bn1 = tf.layers.batch_normalization(init_conv1, training=training)
+            bn1 = _batch_norm(init_conv1, training)
             conv_relu1 = tf.nn.relu(bn1)
 
         with tf.variable_scope('mobilenetv2'):
@@ -33,7 +46,8 @@ def build_model(inputs, training: bool):
 
         with tf.variable_scope('input_locations'):
             input_locations = utils.soft_argmax_rescaled(input_heatmaps)
-            locations_flat = tf.layers.flatten(input_locations)
+            locations_flat = tf.cast(tf.layers.flatten(input_locations),
+                                     compute_dtype)
 
         with tf.variable_scope('bilinear_blocks'):
             features_flat = tf.layers.flatten(mn)
@@ -42,7 +56,7 @@ def build_model(inputs, training: bool):
             in_concat = tf.concat([features_drop, locations_flat], axis=1)
             l_units = 1536
             in_dense = tf.layers.dense(in_concat, l_units)
-            in_bn = tf.layers.batch_normalization(in_dense, training=training)
+            in_bn = _batch_norm(in_dense, training)
             in_relu = tf.nn.relu(in_bn)
             bl1 = _bilinear_res_block(in_relu, l_units, training,
                                       input_activation=False)
@@ -53,7 +67,7 @@ def build_model(inputs, training: bool):
         with tf.variable_scope('camera_blocks'):
             cam_units = 256
             cam_d = tf.layers.dense(locations_flat, cam_units)
-            cam_bn = tf.layers.batch_normalization(cam_d, training=training)
+            cam_bn = _batch_norm(cam_d, training)
             cam_relu = tf.nn.relu(cam_bn)
             bl1_cam = _bilinear_res_block(cam_relu, cam_units, training,
                                           input_activation=False)
@@ -62,6 +76,9 @@ def build_model(inputs, training: bool):
             bl4_cam = _bilinear_res_block(bl3_cam, cam_units, training)
 
         with tf.variable_scope('out_fc'):
+            # float32 - the initial weights are below the float16 range
+            bl4 = tf.cast(bl4, tf.float32)
+            bl4_cam = tf.cast(bl4_cam, tf.float32)
             out_init = tf.truncated_normal_initializer(stddev=1e-7)
             out_pose = tf.layers.dense(
                 bl4, 72, kernel_initializer=out_init)     # 24*3 rotations
@@ -72,16 +89,39 @@ def build_model(inputs, training: bool):
     return out
 
 
+def _float32_variable_getter(getter, *args, **kwargs):
+    # Layers running in reduced precision ask for variables of that type:
+    # keep the master copy in float32 and give the layer a cast of it
+    dtype = kwargs.get('dtype')
+    kwargs['dtype'] = tf.float32
+    variable = getter(*args, **kwargs)
+    if dtype is not None and dtype != tf.float32:
+        variable = tf.cast(variable, dtype)
+    return variable
+
+
+def _batch_norm(inputs, training: bool):
+    # Statistics and parameters in float32 whatever the compute precision.
+    # The fused batch norm of the conv layers takes reduced precision inputs
+    # as they are; the dense layers' is not fused, so is run in float32
+    if inputs.get_shape().ndims == 4:
+        return tf.layers.batch_normalization(inputs, training=training,
+                                             fused=True)
+    bn = tf.layers.batch_normalization(tf.cast(inputs, tf.float32),
+                                       training=training)
+    return tf.cast(bn, inputs.dtype)
+
+
 def _bilinear_res_block(inputs, units, training: bool, input_activation=True):
     if input_activation:
-        in_bn = tf.layers.batch_normalization(inputs, training=training)
+        in_bn = _batch_norm(inputs, training)
         in_relu = tf.nn.relu(in_bn)
         linear_in = tf.layers.dropout(in_relu, 0.2, training=training)
     else:
         linear_in = inputs
     linear1 = tf.layers.dense(linear_in, units)
 
-    bn1 = tf.layers.batch_normalization(linear1, training=training)
+    bn1 = _batch_norm(linear1, training)
     relu1 = tf.nn.relu(bn1)
     dropout1 = tf.layers.dropout(relu1, 0.2, training=training)
     linear2 = tf.layers.dense(dropout1, units)
@@ -93,7 +133,7 @@ def _bilinear_res_block(inputs, units, training: bool, input_activation=True):
 def _mobilenetv2(inputs, training: bool, alpha=1.4):
     init_filters = _make_divisible(32 * alpha, 8)
     init_conv2d = tf.layers.conv2d(inputs, init_filters, [3, 3], 2)
-    init_bn = tf.layers.batch_normalization(init_conv2d, training=training)
+    init_bn = _batch_norm(init_conv2d, training)
     init_relu = tf.nn.relu6(init_bn)
 
     mn1 = _mobilenetv2_block(init_relu, 16, 1, 1, alpha, training)
@@ -122,7 +162,7 @@ def _mobilenetv2(inputs, training: bool, alpha=1.4):
 
     last_filters = _make_divisible(1280 * alpha, 8) if alpha > 1.0 else 1280
     last_conv = tf.layers.conv2d(mn17, last_filters, [1, 1])
-    last_bn = tf.layers.batch_normalization(last_conv, training=training)
+    last_bn = _batch_norm(last_conv, training)
     last_relu = tf.nn.relu6(last_bn)
 
     pool = tf.reduce_mean(last_relu, axis=[1, 2])
@@ -136,17 +176,28 @@ def _mobilenetv2_block(inputs, filters: int, stride: int, expansion: int,
 
     if expansion > 1:
         expand = tf.layers.conv2d(inputs, expansion * in_channels, [1, 1])
-        ex_bn = tf.layers.batch_normalization(expand, training=training)
+        ex_bn = _batch_norm(expand, training)
         ex_out = tf.nn.relu6(ex_bn)
     else:
         ex_out = inputs
 
-    depthwise = keras.layers.DepthwiseConv2D([3, 3], stride,
-                                             padding='same')(ex_out)
-    dw_bn = tf.layers.batch_normalization(depthwise, training=training)
+    # Variables from tf.get_variable rather than a Keras layer, so they go
+    # through the variable scope's custom getter and the conv runs in the
+    # compute precision. Named as the Keras DepthwiseConv2D named them
+    ex_channels = ex_out.get_shape().as_list()[-1]
+    with tf.variable_scope(None, default_name='depthwise_conv2d'):
+        dw_kernel = tf.get_variable(
+            'depthwise_kernel', [3, 3, ex_channels, 1], dtype=ex_out.dtype,
+            initializer=tf.glorot_uniform_initializer())
+        dw_bias = tf.get_variable('bias', [ex_channels], dtype=ex_out.dtype,
+                                  initializer=tf.zeros_initializer())
+    depthwise = tf.nn.depthwise_conv2d(ex_out, dw_kernel,
+                                       [1, stride, stride, 1], 'SAME')
+    depthwise = tf.nn.bias_add(depthwise, dw_bias)
+    dw_bn = _batch_norm(depthwise, training)
     dw_relu = tf.nn.relu6(dw_bn)
     pointwise = tf.layers.conv2d(dw_relu, pointwise_conv_filters, [1, 1])
-    pw_bn = tf.layers.batch_normalization(pointwise, training=training)
+    pw_bn = _batch_norm(pointwise, training)
 
     if in_channels == pointwise_conv_filters and stride == 1:
         out = tf.add(inputs, pw_bn)
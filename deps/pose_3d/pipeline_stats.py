@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import functools
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+
+class _ReaderTimes:
+    # Latency of the py_func readers, which run on tf.data threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.examples = 0
+        self.total_secs = 0.0
+        self.max_secs = 0.0
+
+    def add(self, secs, n_examples):
+        with self.lock:
+            self.calls += 1
+            self.examples += n_examples
+            self.total_secs += secs
+            self.max_secs = max(self.max_secs, secs)
+
+    def pop(self):
+        with self.lock:
+            times = (self.calls, self.examples, self.total_secs,
+                     self.max_secs)
+            self.reset()
+        return times
+
+
+reader_times = _ReaderTimes()
+
+
+def timed_reader(read_fn):
+    """ Wrap a py_func reader returning a tuple of per-example arrays so its
+    latency and number of examples are recorded for PipelineStats """
+    @functools.wraps(read_fn)
+    def timed(*args):
+        start = time.time()
+        outputs = read_fn(*args)
+        reader_times.add(time.time() - start, len(outputs[0]))
+        return outputs
+    return timed
+
+
+class PipelineStats:
+    """ Per-step timing of the train loop, split into the time blocked on the
+    input pipeline and the compute time. Every trace_steps steps a step is
+    run with a software trace and the time spent in IteratorGetNext is read
+    from it. report() summarises the steps since the previous report, with
+    the py_func reader latency and the prefetch buffer utilisation, as a
+    console line, a JSON line appended to report_path and a tf.Summary """
+    def __init__(self, report_path=None, trace_steps=50):
+        self.report_path = report_path
+        self.trace_steps = trace_steps
+        self.trace_options = tf.RunOptions(
+            trace_level=tf.RunOptions.SOFTWARE_TRACE)
+        self._reset()
+        self.last_report = time.time()
+        reader_times.reset()
+
+    def _reset(self):
+        self.step_secs = []
+        self.wait_secs = []
+        self.traced_step_secs = []
+        self.n_examples = 0
+        self.prefetch_utilization = None
+
+    def run_options(self, step: int):
+        """ RunOptions and RunMetadata for the run of this step """
+        if step % self.trace_steps == 0:
+            return self.trace_options, tf.RunMetadata()
+        return None, None
+
+    def record_step(self, secs, n_examples: int, run_metadata=None):
+        self.step_secs.append(secs)
+        self.n_examples += n_examples
+        if run_metadata is not None:
+            wait_micros = sum(
+                node.all_end_rel_micros
+                for dev in run_metadata.step_stats.dev_stats
+                for node in dev.node_stats
+                if 'IteratorGetNext' in node.node_name)
+            self.wait_secs.append(wait_micros / 1e6)
+            self.traced_step_secs.append(secs)
+
+    def record_pipeline_summary(self, summary_bytes):
+        """ Prefetch buffer utilisation from a StatsAggregator summary """
+        summary = tf.Summary.FromString(summary_bytes)
+        for value in summary.value:
+            if (value.tag.endswith('buffer_utilization') and
+                    value.histo.num > 0):
+                self.prefetch_utilization = value.histo.sum / value.histo.num
+
+    def report(self, step: int):
+        """ Print and record the stats since the last report. Returns a
+        tf.Summary of them to write at step """
+        now = time.time()
+        calls, read_examples, read_secs, read_max_secs = reader_times.pop()
+        stats = {'step': int(step), 'time': now, 'steps': len(self.step_secs)}
+        if self.step_secs:
+            stats['examples_per_sec'] = (self.n_examples /
+                                         (now - self.last_report))
+            stats['step_ms'] = 1000 * float(np.mean(self.step_secs))
+        if self.wait_secs:
+            wait = float(np.mean(self.wait_secs))
+            traced = float(np.mean(self.traced_step_secs))
+            stats['wait_ms'] = 1000 * wait
+            stats['compute_ms'] = 1000 * max(traced - wait, 0.0)
+            stats['wait_fraction'] = wait / traced if traced > 0 else 0.0
+        if self.prefetch_utilization is not None:
+            stats['prefetch_utilization'] = self.prefetch_utilization
+        if calls:
+            stats['reader_calls'] = calls
+            stats['reader_mean_ms'] = 1000 * read_secs / calls
+            stats['reader_max_ms'] = 1000 * read_max_secs
+            if 'examples_per_sec' in stats and read_examples:
+                # Readers which must be busy at once to keep up: a lower
+                # bound for cycle_length / num_parallel_calls
+                stats['readers_needed'] = (stats['examples_per_sec'] *
+                                           read_secs / read_examples)
+        self._reset()
+        self.last_report = now
+
+        print('\n' + ' '.join(
+            '{} {:.3g}'.format(k, v) for k, v in stats.items()
+            if k not in ('step', 'time')), file=sys.stderr)
+        if self.report_path is not None:
+            with open(self.report_path, 'a') as f:
+                f.write(json.dumps(stats) + '\n')
+        return tf.Summary(value=[
+            tf.Summary.Value(tag='pipeline/' + k, simple_value=v)
+            for k, v in stats.items() if k not in ('step', 'time')])
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import os.path
+import math
+import time
+import datetime
 import pkg_resources
 
 import tensorflow as tf
@@ -12,6 +15,10 @@ import numpy as np
 from .network import build_model, build_discriminator
 from . import config
 from . import utils
+from . import distributed
+from . import export
+from .async_checkpoint import AsyncCheckpointer
+from .pipeline_stats import PipelineStats
 import tf_smpl
 from tf_perspective_projection import project as proj
 
@@ -29,12 +36,42 @@ class PoseModel3d:
                  reproject_loss=True,
                  mesh_loss=True,
                  smpl_model=None,
-                 discriminator=False):
+                 discriminator=False,
+                 server=None,
+                 compute_dtype=tf.float32):
         self.graph = graph if graph is not None else tf.get_default_graph()
-        with self.graph.as_default():
+        # server: tf.train.Server of this worker for data-parallel training
+        # (see distributed.py) - variables are placed on the ps tasks
+        self.server = server
+        # tf.float16 or tf.bfloat16 for mixed precision (see build_model)
+        self.compute_dtype = compute_dtype
+        if server is not None:
+            if mode != 'train':
+                raise ValueError("server is only used in 'train' mode")
+            if discriminator:
+                raise ValueError(
+                    "The discriminator is not supported in distributed "
+                    "training")
+            cluster = tf.train.ClusterSpec(server.server_def.cluster)
+            task_index = server.server_def.task_index
+            self.n_workers = cluster.num_tasks('worker')
+            self.is_chief = task_index == 0
+            self.device_fn = tf.train.replica_device_setter(
+                worker_device='/job:worker/task:{}'.format(task_index),
+                cluster=cluster)
+            self.worker_device = '/job:worker/task:{}'.format(task_index)
+            target = server.target
+            tfconf = distributed.session_config(server)
+        else:
+            self.n_workers = 1
+            self.is_chief = True
+            self.device_fn = None
+            self.worker_device = None
+            target = ''
             tfconf = tf.ConfigProto()
+        with self.graph.as_default(), tf.device(self.device_fn):
             # tfconf.gpu_options.allow_growth = True  # pylint: disable=no-member
-            self.sess = tf.Session(config=tfconf)
+            self.sess = tf.Session(target, config=tfconf)
             # allow using Keras layers in network
             keras.backend.set_session(self.sess)
 
@@ -54,7 +91,8 @@ class PoseModel3d:
                 # placeholders for shape inference
                 self.in_placeholder = tf.placeholder_with_default(
                     self.next_input[0], input_shape)
-                self.outputs = build_model(self.in_placeholder, training)
+                self.outputs = build_model(self.in_placeholder, training,
+                                           compute_dtype)
 
                 self.pose_loss = pose_loss
                 self.mesh_loss = mesh_loss
@@ -75,8 +113,16 @@ class PoseModel3d:
                         d_in = self.outputs
                     self.discriminator_outputs = build_discriminator(d_in)
             else:
-                self.in_placeholder = tf.placeholder(tf.float32, input_shape)
-                self.outputs = build_model(self.in_placeholder, training=False)
+                # Fed directly by estimate, or from a dataset through the
+                # handle by estimate_stream
+                self.input_handle = tf.placeholder(tf.string, shape=[])
+                iterator = tf.data.Iterator.from_string_handle(
+                    self.input_handle, tf.float32, tf.TensorShape(input_shape))
+                self.in_placeholder = tf.placeholder_with_default(
+                    iterator.get_next(), input_shape)
+                self.outputs = build_model(self.in_placeholder, training=False,
+                                           compute_dtype=compute_dtype)
+                self._stream = None
 
             self.step = tf.train.get_or_create_global_step()
 
@@ -84,12 +130,19 @@ class PoseModel3d:
             self.saver = None
 
             subdir = 'train' if training else 'test'
-            self.summary_writer = tf.summary.FileWriter(
-                os.path.join(summary_dir, subdir), self.graph)
+            self.log_dir = os.path.join(summary_dir, subdir)
+            self.summary_writer = None
+            if self.is_chief:
+                self.summary_writer = tf.summary.FileWriter(
+                    self.log_dir, self.graph)
             # self.beholder = Beholder(os.path.join(summary_dir, subdir))
 
-            self.sess.run(tf.global_variables_initializer())
+            # Other workers wait for the chief to initialise in train
+            if self.is_chief:
+                self.sess.run(tf.global_variables_initializer())
 
+            self.mode = mode
+            self.input_shape = input_shape
             self.restore = restore_model
             self.already_restored = False
 
@@ -100,6 +153,20 @@ class PoseModel3d:
                                        {'in': self.in_placeholder},
                                        {'out': self.outputs})
 
+    def export_inference_graph(self, path: str):
+        """ Write an optimised frozen graph of the model for inference to
+        path (see export.freeze_inference_graph), which
+        export.FrozenPoseModel loads. Only for 'test' mode float32 models """
+        if self.mode != 'test' or self.compute_dtype != tf.float32:
+            raise ValueError("Only float32 'test' mode models are exported")
+        with self.graph.as_default():
+            self._prepare_estimate()
+            graph_def = export.freeze_inference_graph(
+                self.sess, self.in_placeholder, self.outputs)
+        export.write_frozen_graph(graph_def, path, self.in_placeholder,
+                                  self.outputs)
+        return graph_def
+
     def restore_from_checkpoint(self):
         """ Restore weights from checkpoint - only runs once """
         with self.graph.as_default():
@@ -127,18 +194,64 @@ class PoseModel3d:
                         "\nContinuing without loading model{}".format(
                         warn_col, self.saver_path, normal_col))
 
+    def _prepare_estimate(self):
+        if self.saver is None:
+            self.saver = tf.train.Saver()
+        if self.restore and not self.already_restored:
+            self.restore_from_checkpoint()
+
     def estimate(self, input_inst):
         """ Run the model on an input instance """
         with self.graph.as_default():
-            if self.saver is None:
-                self.saver = tf.train.Saver()
-            if self.restore:
-                self.restore_from_checkpoint()
+            self._prepare_estimate()
             out = self.sess.run(
                 self.outputs,
                 feed_dict={self.in_placeholder: input_inst})
         return out
 
+    def estimate_stream(self, inputs, batch_size=32):
+        """ Run the model on an iterable of single inputs (e.g. a generator
+        reading and preparing frames), yielding one output per input, in
+        order. Inputs are pulled and batched by a tf.data pipeline, so the
+        next batch is prepared while the model runs on the current one. Only
+        in 'test' mode, and not reentrant: finish one stream before starting
+        another """
+        if self.mode != 'test':
+            raise ValueError("estimate_stream is only available in 'test' "
+                             "mode")
+        with self.graph.as_default():
+            self._prepare_estimate()
+            if self._stream is None:
+                self._stream = self._build_stream()
+            batch_size_ph, init, handle = self._stream
+            self._stream_inputs = iter(inputs)
+            self.sess.run(init, feed_dict={batch_size_ph: batch_size})
+        return self._stream_outputs({self.input_handle: handle})
+
+    def _stream_outputs(self, feed_dict):
+        while True:
+            try:
+                out = self.sess.run(self.outputs, feed_dict=feed_dict)
+            except tf.errors.OutOfRangeError:
+                break
+            yield from out
+        self._stream_inputs = None
+
+    def _build_stream(self):
+        # Built once; each estimate_stream call re-initialises the iterator,
+        # which restarts the generator on that call's inputs
+        def stream_inputs():
+            for input_inst in self._stream_inputs:
+                yield np.asarray(input_inst, dtype=np.float32)
+
+        batch_size_ph = tf.placeholder(tf.int64, shape=[])
+        dataset = tf.data.Dataset.from_generator(
+            stream_inputs, tf.float32, tf.TensorShape(self.input_shape[1:]))
+        dataset = dataset.batch(batch_size_ph).prefetch(2)
+        iterator = dataset.make_initializable_iterator()
+        handle = self.sess.run(iterator.string_handle())
+        return batch_size_ph, iterator.initializer, handle
+
     def get_encoder_losses(self, out_pose, gt_pose, betas, gt_joints2d):
         with self.graph.as_default():
             total_loss = 0
@@ -356,12 +469,54 @@ class PoseModel3d:
                               family='losses')
             return disc_loss, disc_enc_loss
 
-    def train(self, batch_size: int, epochs: int):
-        """ Train the model using the dataset passed in at model creation """
-        with self.graph.as_default():
-            self.dataset = self.dataset.shuffle(batch_size * 96)
+    def train(self, batch_size: int, epochs: int, shuffle_buffer=None,
+              examples_per_epoch=None, scalar_summary_steps=10,
+              image_summary_steps=200, checkpoint_steps=2000,
+              accumulate_steps=1, keep_checkpoints=5,
+              keep_best_checkpoints=2, stats_steps=500, trace_steps=50):
+        """ Train the model using the dataset passed in at model creation
+        shuffle_buffer defaults to batch_size * 96 examples. Pass 0 for
+        datasets which are already shuffled, e.g. a shuffled frame index.
+        If examples_per_epoch is given (e.g. from the dataset manifest) the
+        epoch progress and ETA are printed with the step.
+        In distributed training each worker's dataset is its own shard of the
+        files and is repeated; examples_per_epoch (of the whole dataset) is
+        then required and sets the number of synchronous steps per epoch.
+        Summaries are only computed on the steps they are written, scalars
+        every scalar_summary_steps and images (mesh renders, the expensive
+        part) every image_summary_steps. The graph is finalized before the
+        train loop starts.
+        With accumulate_steps > 1 the gradients of that many batches are
+        averaged before each update, for an effective batch of batch_size *
+        accumulate_steps (steps, summaries and checkpoints count updates).
+        Batch norm still normalises over, and updates its moving averages
+        after, each batch of batch_size, so its momentum is per batch and
+        batch_size should stay large enough for stable batch statistics.
+        Checkpoints are written in the background (see AsyncCheckpointer),
+        keeping the last keep_checkpoints and the keep_best_checkpoints with
+        the lowest mean loss since the previous checkpoint.
+        Every stats_steps the input pipeline wait (from a trace every
+        trace_steps) and compute times, examples/s, prefetch utilisation and
+        reader latency are reported (see PipelineStats), also to
+        pipeline_stats.jsonl in the summary directory """
+        with self.graph.as_default(), tf.device(self.device_fn):
+            if self.server is not None and not examples_per_epoch:
+                raise ValueError(
+                    "examples_per_epoch is needed for distributed training")
+            if shuffle_buffer is None:
+                shuffle_buffer = batch_size * 96
+            if shuffle_buffer > 0:
+                self.dataset = self.dataset.shuffle(shuffle_buffer)
+            if self.server is not None:
+                # Workers stop on the step count, not the end of their shard,
+                # so none is left waiting for the others' gradients
+                self.dataset = self.dataset.repeat()
             self.dataset = self.dataset.batch(batch_size)
             self.dataset = self.dataset.prefetch(16)
+            stats_aggregator = tf.contrib.data.StatsAggregator()
+            self.dataset = self.dataset.apply(
+                tf.contrib.data.set_stats_aggregator(stats_aggregator))
+            pipeline_summary = stats_aggregator.get_summary()
             # self.dataset = self.dataset.apply(
             #     prefetching_ops.copy_to_device("/gpu:0")).prefetch(1)
             iterator = self.dataset.make_initializable_iterator()
@@ -381,77 +536,272 @@ class PoseModel3d:
                 disc_optimizer = tf.train.AdamOptimizer(learning_rate=4e-4)
                 discriminator_vars = tf.get_collection(
                     tf.GraphKeys.TRAINABLE_VARIABLES, scope='discriminator')
-                train_discriminator = disc_optimizer.minimize(
-                    disc_total_loss, var_list=discriminator_vars)
+                accumulate_discriminator, train_discriminator, accums = (
+                    self._minimize(disc_optimizer, disc_total_loss,
+                                   discriminator_vars, accumulate_steps))
                 self.sess.run(tf.variables_initializer(
-                    disc_optimizer.variables()))
+                    disc_optimizer.variables() + accums))
                 total_loss += disc_enc_loss
 
             tf.summary.scalar('total_loss', total_loss, family='losses')
-            summary = tf.summary.merge_all()
-
-            optimizer = tf.train.AdamOptimizer(learning_rate=2e-4)
+            summaries = tf.get_collection(tf.GraphKeys.SUMMARIES)
+            scalar_summary = tf.summary.merge(
+                [ s for s in summaries if s.op.type != 'ImageSummary' ])
+            image_summaries = [ s for s in summaries
+                                if s.op.type == 'ImageSummary' ]
+            image_summary = None
+            if image_summaries:
+                image_summary = tf.summary.merge(image_summaries)
+
+            # Wrappers do not report the slots of the optimizer they wrap
+            base_optimizer = tf.train.AdamOptimizer(learning_rate=2e-4)
+            optimizer = base_optimizer
+            loss_scale_vars = []
+            if self.compute_dtype == tf.float16:
+                # Dynamic loss scaling keeps small float16 gradients from
+                # flushing to zero; bfloat16 has the float32 range
+                with tf.variable_scope('loss_scale'):
+                    loss_scale_manager = (
+                        tf.contrib.mixed_precision.
+                        ExponentialUpdateLossScaleManager(
+                            init_loss_scale=2**15, incr_every_n_steps=1000))
+                loss_scale_vars = tf.get_collection(
+                    tf.GraphKeys.GLOBAL_VARIABLES, scope='loss_scale')
+                optimizer = tf.contrib.mixed_precision.LossScaleOptimizer(
+                    optimizer, loss_scale_manager)
+            if self.server is not None:
+                # Average the gradients of one batch from every worker
+                optimizer = tf.train.SyncReplicasOptimizer(
+                    optimizer, replicas_to_aggregate=self.n_workers,
+                    total_num_replicas=self.n_workers)
             encoder_vars = tf.get_collection(
                 tf.GraphKeys.TRAINABLE_VARIABLES, scope='encoder')
             update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
             with tf.control_dependencies(update_ops):
-                train = optimizer.minimize(
-                    total_loss * config.total_loss_scale,
-                    global_step=self.step, var_list=encoder_vars)
-            self.sess.run(tf.variables_initializer(optimizer.variables()))
+                accumulate, train, accums = self._minimize(
+                    optimizer, total_loss * config.total_loss_scale,
+                    encoder_vars, accumulate_steps, global_step=self.step)
+            # Every worker has its own accumulators
+            self.sess.run(tf.variables_initializer(accums))
+            # Fetch the incremented step with the train op rather than in a
+            # separate run each step
+            with tf.control_dependencies([train]):
+                step_after = self.step.read_value()
+            train_fetches = {'step': step_after, 'loss': total_loss}
+            accumulate_fetches = {'accumulate': accumulate}
+            if self.discriminator:
+                train_fetches['train_discriminator'] = train_discriminator
+                accumulate_fetches['accumulate_discriminator'] = (
+                    accumulate_discriminator)
 
+            # The loss scale is not saved, so float32 checkpoints restore
+            saved_vars = [ v for v in tf.global_variables()
+                           if v not in loss_scale_vars ]
             if self.saver is None:
-                self.saver = tf.train.Saver()
-            if self.restore:
-                self.restore_from_checkpoint()
-
-            self.summary_writer.add_graph(self.graph)
-
-            # Train loop
-            for _ in range(epochs):
-                self.sess.run(iterator.initializer)
-                feed = {self.input_handle: train_handle}
-                while True:
-                    gs = tf.train.global_step(self.sess, self.step)
-                    try:
-                        if self.discriminator:
-                            _, summary_eval, _ = self.sess.run(
-                                (train, summary, train_discriminator),
-                                feed_dict=feed)
+                self.saver = tf.train.Saver(saved_vars,
+                                            sharded=self.server is not None)
+            # Only the chief initialises, restores, saves and writes summaries
+            checkpointer = None
+            if self.is_chief:
+                checkpointer = AsyncCheckpointer(
+                    self.sess, saved_vars, self.saver_path,
+                    keep_last=keep_checkpoints,
+                    keep_best=keep_best_checkpoints,
+                    device=self.worker_device)
+                self.sess.run(tf.variables_initializer(
+                    base_optimizer.variables() + loss_scale_vars))
+                if self.restore:
+                    self.restore_from_checkpoint()
+                self.summary_writer.add_graph(self.graph)
+            else:
+                distributed.wait_for_variables(self.sess)
+            release_workers = None
+            if self.server is not None:
+                self.sess.run(optimizer.local_step_init_op)
+                if self.is_chief:
+                    optimizer.get_chief_queue_runner().create_threads(
+                        self.sess, daemon=True, start=True)
+                    self.sess.run(optimizer.get_init_tokens_op())
+                    # Once the chief stops aggregating, workers which have
+                    # pushed gradients wait for a token: one each lets them
+                    # see the final step and stop too
+                    release_workers = optimizer.get_init_tokens_op(
+                        num_tokens=self.n_workers)
+
+            gs = tf.train.global_step(self.sess, self.step)
+            steps_per_epoch = None
+            first_epoch = 0
+            if examples_per_epoch:
+                steps_per_epoch = math.ceil(
+                    examples_per_epoch /
+                    (batch_size * accumulate_steps * self.n_workers))
+            if self.server is not None:
+                # Resume from the restored step
+                first_epoch = gs // steps_per_epoch
+
+            # No ops are added from here, so none can leak into the loop.
+            # Undone on return so the model can still be saved, exported or
+            # evaluated
+            self.graph.finalize()
+            try:
+                stats = None
+                if self.is_chief:
+                    stats = PipelineStats(
+                        os.path.join(self.log_dir, 'pipeline_stats.jsonl'),
+                        trace_steps=trace_steps)
+
+                # Train loop - partial gradient sums carry over between epochs
+                micro_step = 0
+                loss_sum, loss_count = 0.0, 0
+                for epoch in range(first_epoch, epochs):
+                    self.sess.run(iterator.initializer)
+                    feed = {self.input_handle: train_handle}
+                    epoch_step = 0
+                    epoch_start = time.time()
+                    while True:
+                        if (self.server is not None and
+                                gs >= (epoch + 1) * steps_per_epoch):
+                            break
+                        micro_step += 1
+                        step_start = time.time()
+                        if micro_step % accumulate_steps != 0:
+                            try:
+                                self.sess.run(accumulate_fetches,
+                                              feed_dict=feed)
+                            except tf.errors.OutOfRangeError:
+                                micro_step -= 1
+                                break
+                            if stats is not None:
+                                stats.record_step(time.time() - step_start,
+                                                  batch_size)
+                            continue
+                        fetches = dict(train_fetches)
+                        options, run_metadata = None, None
+                        if self.is_chief:
+                            options, run_metadata = stats.run_options(gs)
+                            if gs % scalar_summary_steps == 0:
+                                fetches['scalars'] = scalar_summary
+                            if (image_summary is not None and
+                                    gs % image_summary_steps == 0):
+                                fetches['images'] = image_summary
+                            if gs % stats_steps == 0:
+                                fetches['pipeline'] = pipeline_summary
+                        try:
+                            results = self.sess.run(fetches, feed_dict=feed,
+                                                    options=options,
+                                                    run_metadata=run_metadata)
+                        except tf.errors.OutOfRangeError:
+                            micro_step -= 1
+                            break
+                        # Summaries are of the step before the update
+                        for key in ('scalars', 'images', 'pipeline'):
+                            if key in results:
+                                self.summary_writer.add_summary(
+                                    results[key], gs)
+                                # self.beholder.update(session=self.sess)
+                        gs = results['step']
+                        epoch_step += 1
+                        if not self.is_chief:
+                            continue
+                        loss_sum += results['loss']
+                        loss_count += 1
+                        stats.record_step(time.time() - step_start, batch_size,
+                                          run_metadata)
+                        if 'pipeline' in results:
+                            stats.record_pipeline_summary(results['pipeline'])
+                            self.summary_writer.add_summary(
+                                stats.report(gs), gs)
+                        if steps_per_epoch is None:
+                            print("\r{:7}".format(gs), end=' ', flush=True)
                         else:
-                            _, summary_eval = self.sess.run(
-                                (train, summary), feed_dict=feed)
-                    except tf.errors.OutOfRangeError:
-                        break
-                    print("\r{:7}".format(gs), end=' ', flush=True)
-                    if gs % 10 == 0:
-                        self.summary_writer.add_summary(summary_eval, gs)
-                        # self.beholder.update(session=self.sess)
-                    if gs % 2000 == 0:
-                        self.saver.save(self.sess, self.saver_path,
-                                        global_step=self.step)
-                self.saver.save(self.sess, self.saver_path,
-                                global_step=self.step)
-
-    def evaluate(self):
-        """ Evaluate the dataset passed in at the model creation time """
+                            remaining = max(steps_per_epoch - epoch_step, 0)
+                            eta = ((time.time() - epoch_start) / epoch_step *
+                                   remaining)
+                            progress = min(epoch_step / steps_per_epoch, 1.0)
+                            print("\r{:7} epoch {} {:5.1%} ETA {}".format(
+                                gs, epoch, progress,
+                                datetime.timedelta(seconds=int(eta))),
+                                end=' ', flush=True)
+                        if gs % checkpoint_steps == 0:
+                            # Skipped if the last one is still being written
+                            if checkpointer.save(gs, loss_sum / loss_count):
+                                loss_sum, loss_count = 0.0, 0
+                    if self.is_chief and loss_count:
+                        if checkpointer.save(gs, loss_sum / loss_count):
+                            loss_sum, loss_count = 0.0, 0
+                if release_workers is not None:
+                    self.sess.run(release_workers)
+                if self.is_chief:
+                    # The final checkpoint waits for any write in progress
+                    checkpointer.save(
+                        gs, loss_sum / loss_count if loss_count else None,
+                        block=True)
+                    checkpointer.close()
+            finally:
+                # pylint: disable=protected-access
+                self.graph._unsafe_unfinalize()
+
+    def _minimize(self, optimizer, loss, var_list, accumulate_steps: int,
+                  global_step=None):
+        """ Ops to minimize loss with the gradients averaged over
+        accumulate_steps batches. Returns the op to run for all but the last
+        of them (accumulates only), the op for the last one (accumulates,
+        applies and resets) and the accumulator variables to initialise """
+        if accumulate_steps == 1:
+            train = optimizer.minimize(loss, global_step=global_step,
+                                       var_list=var_list)
+            return train, train, []
+        grads_vars = [ (g, v) for g, v in optimizer.compute_gradients(
+            loss, var_list=var_list) if g is not None ]
+        # Local to the worker in distributed training and not checkpointed
+        with tf.name_scope('accumulate_gradients'), \
+                tf.device(self.worker_device):
+            # Outside any control dependencies of the caller (e.g. the batch
+            # norm updates), so initialising them doesn't run the model
+            with tf.control_dependencies(None):
+                accums = [
+                    tf.Variable(tf.zeros(v.shape, v.dtype.base_dtype),
+                                trainable=False,
+                                collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                    for _, v in grads_vars ]
+            accumulate = tf.group(*[
+                accum.assign_add(g / accumulate_steps)
+                for accum, (g, _) in zip(accums, grads_vars) ])
+        with tf.control_dependencies([accumulate]):
+            apply = optimizer.apply_gradients(
+                [ (accum.read_value(), v)
+                  for accum, (_, v) in zip(accums, grads_vars) ],
+                global_step=global_step)
+        with tf.control_dependencies([apply]):
+            train = tf.group(*[ accum.assign(tf.zeros_like(accum))
+                                for accum in accums ])
+        return accumulate, train, accums
+
+    def evaluate(self, estimate_fn=None):
+        """ Evaluate the dataset passed in at the model creation time.
+        estimate_fn evaluates another implementation of the model instead
+        (e.g. QuantizedPoseModel3d.estimate), called on each batch of inputs
+        and returning the outputs this model would """
         with self.graph.as_default():
+            self._prepare_estimate()
             iterator = self.dataset.make_initializable_iterator()
             eval_handle = self.sess.run(iterator.string_handle())
 
             _, gt_pose, betas, gt_joints2d, _ = self.next_input
+            outputs = tf.placeholder_with_default(self.outputs,
+                                                  self.outputs.shape)
 
-            out_pose = self.outputs[:, :72]
+            out_pose = outputs[:, :72]
             pose_error = tf.losses.mean_squared_error(
                 labels=gt_pose, predictions=out_pose)
 
             _ = self.smpl(betas, out_pose, get_skin=False)
             out_joints = self.smpl.J_transformed
-            out_cam_pos = tf.tile(self.outputs[:, 72:75],
+            out_cam_pos = tf.tile(outputs[:, 72:75],
                                   [1, config.n_joints_smpl])
-            out_cam_rot = tf.tile(self.outputs[:, 75:78],
+            out_cam_rot = tf.tile(outputs[:, 75:78],
                                   [1, config.n_joints_smpl])
-            out_cam_f = tf.tile(self.outputs[:, 78],
+            out_cam_f = tf.tile(outputs[:, 78:79],
                                 [1, config.n_joints_smpl])
             # Flip y-axis since it is in image coordinates
             gt_joints2d *= tf.constant([1.0, -1.0])
@@ -474,9 +824,21 @@ class PoseModel3d:
             all_reproj_errors = []
             while True:
                 try:
-                    pose_error_eval, reproj_error_eval = self.sess.run(
-                        (pose_error, reproj_error),
-                        feed_dict=feed)
+                    if estimate_fn is None:
+                        pose_error_eval, reproj_error_eval = self.sess.run(
+                            (pose_error, reproj_error),
+                            feed_dict=feed)
+                    else:
+                        # Feeding the batch back in stops the errors pulling
+                        # another one from the iterator
+                        batch = self.sess.run(self.next_input[:4],
+                                              feed_dict=feed)
+                        batch_feed = dict(zip(self.next_input[1:4],
+                                              batch[1:]))
+                        batch_feed[outputs] = estimate_fn(batch[0])
+                        pose_error_eval, reproj_error_eval = self.sess.run(
+                            (pose_error, reproj_error),
+                            feed_dict=batch_feed)
                     all_pose_errors.append(pose_error_eval)
                     all_reproj_errors.append(reproj_error_eval)
                 except tf.errors.OutOfRangeError:
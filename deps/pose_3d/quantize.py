@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import numpy as np
+import tensorflow as tf
+
+
+def representative_inputs(dataset, n_examples: int, shuffle_buffer=1000,
+                          seed=0):
+    """ n_examples model inputs (the first element of each example) from a
+    dataset of single examples such as dataset_from_filenames_surreal's,
+    shuffled so they are not all from the first clips. The float32 inputs
+    of the uncompacted dataset are needed, as the exported graph has no
+    input conversion. Run in the dataset's graph """
+    dataset = dataset.shuffle(shuffle_buffer, seed=seed).take(n_examples)
+    next_input = dataset.make_one_shot_iterator().get_next()[0]
+    inputs = []
+    with tf.Session() as sess:
+        while True:
+            try:
+                inputs.append(sess.run(next_input))
+            except tf.errors.OutOfRangeError:
+                break
+    return np.array(inputs, dtype=np.float32)
+
+
+def quantize_frozen_graph(frozen_path, out_path, calibration_inputs):
+    """ Convert a graph written by PoseModel3d.export_inference_graph to an
+    int8 TFLite model, with the activation ranges calibrated on
+    calibration_inputs. The input and output stay float32, and ops without
+    an int8 kernel fall back to float """
+    with open(frozen_path + '.json') as f:
+        names = json.load(f)
+    in_name = names['input'].split(':')[0]
+    out_name = names['output'].split(':')[0]
+    shape = [1] + names['input_shape'][1:]
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(
+        frozen_path, [in_name], [out_name], input_shapes={in_name: shape})
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    def representative_dataset():
+        for input_inst in calibration_inputs:
+            yield [input_inst[np.newaxis]]
+
+    converter.representative_dataset = representative_dataset
+    tflite_model = converter.convert()
+    with open(out_path, 'wb') as f:
+        f.write(tflite_model)
+    return tflite_model
+
+
+class QuantizedPoseModel3d:
+    """ Runs a TFLite model written by quantize_frozen_graph, with the same
+    estimate() as PoseModel3d in 'test' mode """
+    def __init__(self, tflite_path):
+        self.interpreter = tf.lite.Interpreter(model_path=tflite_path)
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = 1
+
+    def estimate(self, input_inst):
+        """ Run the model on an input instance """
+        input_inst = np.asarray(input_inst, dtype=np.float32)
+        if len(input_inst) != self.batch_size:
+            # The model is converted with batch size 1
+            self.interpreter.resize_tensor_input(self.input_index,
+                                                 input_inst.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(input_inst)
+        self.interpreter.set_tensor(self.input_index, input_inst)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+import numpy as np
+
+from . import config
+
+
+INDEX_FILENAME = 'index.json'
+
+
+def shard_fields(img_size, n_joints: int):
+    """ Name, dtype and per-frame shape of each array stored in a shard """
+    h, w = img_size
+    # Heatmaps are stored as float16 to halve the size of the shards
+    return [('heatmaps', np.float16, (h, w, n_joints)),
+            ('frames', np.uint8, (h, w, 3)),
+            ('poses', np.float32, (72,)),
+            ('shapes', np.float32, (10,)),
+            ('joints2d', np.float32, (24, 2)),
+            ('zrot', np.float32, ()),
+            ('mask', np.bool_, ())]
+
+
+class ShardWriter:
+    """ Packs whole SURREAL clips into fixed-layout .npy shards which can be
+    memory-mapped by SurrealShards. The layout is planned up front from the
+    clip lengths so each shard file is allocated once at its final size. """
+    def __init__(self,
+                 out_dir,
+                 clip_names,
+                 clip_lengths,
+                 frames_per_shard=1000,
+                 img_size=config.input_img_size,
+                 n_joints=config.n_joints):
+        self.out_dir = out_dir
+        self.fields = shard_fields(img_size, n_joints)
+        self.img_size = img_size
+        self.n_joints = n_joints
+
+        # Clips are never split across shards
+        self.shards = []
+        self.clips = []
+        for name, length in zip(clip_names, clip_lengths):
+            length = int(length)
+            shard_full = self.shards and self.shards[-1]['n_frames'] > 0 and (
+                self.shards[-1]['n_frames'] + length > frames_per_shard)
+            if not self.shards or shard_full:
+                self.shards.append({'dir': 'shard_{:05d}'.format(
+                    len(self.shards)), 'n_frames': 0})
+            shard = self.shards[-1]
+            self.clips.append({'name': name, 'shard': len(self.shards) - 1,
+                               'start': shard['n_frames'],
+                               'n_frames': length, 'written': False})
+            shard['n_frames'] += length
+
+        self._open_shard_idx = None
+        self._arrays = {}
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _open_shard(self, shard_idx: int):
+        if shard_idx == self._open_shard_idx:
+            return
+        self._flush()
+        shard = self.shards[shard_idx]
+        shard_dir = os.path.join(self.out_dir, shard['dir'])
+        os.makedirs(shard_dir, exist_ok=True)
+        # New files are zero filled, so unwritten clips have an all false mask
+        self._arrays = {
+            name: np.lib.format.open_memmap(
+                os.path.join(shard_dir, name + '.npy'), mode='w+',
+                dtype=dtype, shape=(shard['n_frames'],) + shape)
+            for name, dtype, shape in self.fields }
+        self._open_shard_idx = shard_idx
+
+    def _flush(self):
+        for array in self._arrays.values():
+            array.flush()
+        self._arrays = {}
+        self._open_shard_idx = None
+
+    def write_clip(self, clip_idx: int, heatmaps, frames, poses, shapes,
+                   joints2d, zrot, mask):
+        clip = self.clips[clip_idx]
+        values = (heatmaps, frames, poses, shapes, joints2d, zrot, mask)
+        for (name, _, _), value in zip(self.fields, values):
+            if len(value) != clip['n_frames']:
+                raise ValueError(
+                    "{} has {} frames for clip {}, expected {}".format(
+                        name, len(value), clip['name'], clip['n_frames']))
+        self._open_shard(clip['shard'])
+        rows = slice(clip['start'], clip['start'] + clip['n_frames'])
+        for (name, dtype, _), value in zip(self.fields, values):
+            self._arrays[name][rows] = np.asarray(value, dtype=dtype)
+        clip['written'] = True
+
+    def close(self):
+        self._flush()
+        index = {'img_size': list(self.img_size),
+                 'n_joints': self.n_joints,
+                 'shards': self.shards,
+                 'clips': self.clips}
+        index_path = os.path.join(self.out_dir, INDEX_FILENAME)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+
+class SurrealShards:
+    """ Random access reader for shards written by ShardWriter. Arrays are
+    memory-mapped, so reading a frame only touches the pages it lives on.
+    Rows are global frame indices over all shards. """
+    def __init__(self, shards_dir):
+        self.shards_dir = shards_dir
+        with open(os.path.join(shards_dir, INDEX_FILENAME)) as f:
+            index = json.load(f)
+        self.shards = index['shards']
+        self.clips = index['clips']
+        self.fields = shard_fields(index['img_size'], index['n_joints'])
+        self.offsets = np.cumsum(
+            [0] + [shard['n_frames'] for shard in self.shards])
+        self._arrays = {}  # (shard index, field name): memmap
+
+    @property
+    def n_clips(self):
+        return len(self.clips)
+
+    def _array(self, shard_idx: int, name: str):
+        key = (shard_idx, name)
+        if key not in self._arrays:
+            self._arrays[key] = np.load(
+                os.path.join(self.shards_dir, self.shards[shard_idx]['dir'],
+                             name + '.npy'), mmap_mode='r')
+        return self._arrays[key]
+
+    def clip_rows(self, clip_idx):
+        """ Global rows of the frames of a clip which are used for training """
+        clip = self.clips[int(clip_idx)]
+        start = self.offsets[clip['shard']] + clip['start']
+        mask = self._array(clip['shard'], 'mask')[
+            clip['start']:clip['start'] + clip['n_frames']]
+        return np.flatnonzero(mask)[::config.frame_skip] + start
+
+    def frame_rows(self):
+        """ Global rows of all frames which are used for training """
+        return np.concatenate([ self.clip_rows(clip_idx)
+                                for clip_idx in range(self.n_clips) ])
+
+    def read_rows(self, rows):
+        """ Read heatmaps, frames, poses, shapes, joints2d and zrot for the
+        given global rows, in the order given """
+        rows = np.asarray(rows, dtype=np.int64)
+        shard_idxs = np.searchsorted(self.offsets, rows, side='right') - 1
+        out = [ np.empty((len(rows),) + shape, dtype=dtype)
+                for _, dtype, shape in self.fields[:-1] ]
+        for shard_idx in np.unique(shard_idxs):
+            in_shard = shard_idxs == shard_idx
+            local_rows = rows[in_shard] - self.offsets[shard_idx]
+            for (name, _, _), values in zip(self.fields, out):
+                values[in_shard] = self._array(shard_idx, name)[local_rows]
+        return tuple(out)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import numpy as np
+import scipy.io
+import cv2
+
+from . import config
+from .data_helpers import quantize_heatmaps
+
+
+N_HEATMAP_CHANNELS = 19  # OpenPose COCO parts including background
+
+
+def write_synthetic_dataset(out_dir, n_dirs: int, clips_per_dir: int,
+                            n_frames: int, seed=0, **clip_kwargs):
+    """ Write a fake SURREAL run directory with the same layout and file
+    formats as the real one after heatmap generation:
+    <out_dir>/<subject>_<sequence>/<subject>_<sequence>_c<NNNN>{_maps.mat,
+    _info.mat, _frames/f<NNNN>.jpg, .mp4}. The contents are random but have
+    realistic shapes, types and sizes, for benchmarking the readers. Returns
+    the maps files written """
+    rng = np.random.RandomState(seed)
+    maps_files = []
+    for dir_idx in range(n_dirs):
+        basename = '{:02d}_{:02d}'.format(dir_idx // 10 + 1, dir_idx % 10 + 1)
+        one_dir = os.path.join(out_dir, basename)
+        os.makedirs(one_dir, exist_ok=True)
+        for clip_idx in range(clips_per_dir):
+            clip_base = os.path.join(
+                one_dir, '{}_c{:04d}'.format(basename, clip_idx + 1))
+            write_synthetic_clip(clip_base, n_frames, rng, **clip_kwargs)
+            maps_files.append(clip_base + '_maps.mat')
+    return maps_files
+
+
+def write_synthetic_clip(clip_base, n_frames: int, rng, compact=False,
+                         frames_format='jpg', usable_fraction=0.8):
+    """ Write one clip's files with clip_base as the path prefix.
+    compact writes the maps as compact_maps.py does (uint8, n_joints
+    channels). frames_format is 'jpg' (a _frames directory), 'mp4' or 'both'.
+    About usable_fraction of the frames pass the mask and detection diff """
+    height, width = config.input_img_size
+    joints2d = _random_joints2d(n_frames, height, width, rng)
+
+    info = {'pose': rng.uniform(-0.5, 0.5, (72, n_frames)),
+            'shape': rng.normal(0, 1, (10, n_frames)),
+            'joints2D': np.transpose(joints2d, (2, 1, 0)),  # [2x24xT]
+            'zrot': rng.uniform(-np.pi, np.pi, (n_frames, 1))}
+    scipy.io.savemat(clip_base + '_info.mat', info, do_compression=True)
+
+    n_channels = config.n_joints if compact else N_HEATMAP_CHANNELS
+    heat_mat = _heatmaps(joints2d, n_channels, height, width)
+    usable = rng.uniform(size=n_frames) < usable_fraction
+    diffs = np.where(usable, rng.uniform(0, config.max_detection_diff,
+                                         n_frames), np.nan)
+    maps = {'mask': usable.astype(np.uint8),
+            'diffs': diffs,
+            'detected_2D': np.transpose(joints2d[:, :14], (1, 2, 0)),
+            'visibility_2D': np.ones((14, n_frames), dtype=bool)}
+    if compact:
+        maps['heat_mat'], maps['heat_mat_range'] = quantize_heatmaps(heat_mat)
+    else:
+        maps['heat_mat'] = heat_mat
+    scipy.io.savemat(clip_base + '_maps.mat', maps, do_compression=True)
+
+    frames = _frames(joints2d, height, width, rng)
+    if frames_format in ('jpg', 'both'):
+        frames_dir = clip_base + '_frames'
+        os.makedirs(frames_dir, exist_ok=True)
+        for i, frame in enumerate(frames):
+            # Numbered from 1 like ffmpeg's output
+            cv2.imwrite(os.path.join(frames_dir, 'f{:04d}.jpg'.format(i + 1)),
+                        frame)
+    if frames_format in ('mp4', 'both'):
+        video = cv2.VideoWriter(clip_base + '.mp4',
+                                cv2.VideoWriter_fourcc(*'mp4v'), 30,
+                                (width, height))
+        for frame in frames:
+            video.write(frame)
+        video.release()
+
+
+def _random_joints2d(n_frames, height, width, rng):
+    # A person-sized random walk of 24 joints around the image centre,
+    # shape (time, joints, (x, y))
+    centre = np.array([width / 2, height / 2]) + np.cumsum(
+        rng.normal(0, 2, (n_frames, 2)), axis=0)
+    offsets = rng.uniform(-0.3, 0.3, (24, 2)) * height
+    joints2d = centre[:, np.newaxis] + offsets[np.newaxis]
+    return np.clip(joints2d, 0, [width - 1, height - 1]).astype(np.float32)
+
+
+def _heatmaps(joints2d, n_channels, height, width, sigma=8.0):
+    # Gaussian peak per joint, as separable products: (h, w, channels, time)
+    heat_mat = np.zeros((height, width, n_channels, len(joints2d)),
+                        dtype=np.float32)
+    ys, xs = np.arange(height), np.arange(width)
+    n_peaks = min(n_channels, joints2d.shape[1])
+    for t, joints in enumerate(joints2d[:, :n_peaks]):
+        gx = np.exp(-(xs[:, None] - joints[:, 0]) ** 2 / (2 * sigma ** 2))
+        gy = np.exp(-(ys[:, None] - joints[:, 1]) ** 2 / (2 * sigma ** 2))
+        heat_mat[:, :, :n_peaks, t] = gy[:, None, :] * gx[None, :, :]
+    return heat_mat
+
+
+def _frames(joints2d, height, width, rng):
+    # Smooth background with a blob per joint, so JPEG/video sizes and
+    # decode times are closer to real frames than pure noise
+    background = cv2.resize(
+        rng.randint(0, 256, (6, 8, 3)).astype(np.uint8), (width, height),
+        interpolation=cv2.INTER_CUBIC)
+    frames = np.empty((len(joints2d), height, width, 3), dtype=np.uint8)
+    for t, joints in enumerate(joints2d):
+        frame = background.copy()
+        for x, y in joints:
+            cv2.circle(frame, (int(x), int(y)), 6, (40, 80, 200), -1)
+        frames[t] = frame
+    return frames
@@ -247,17 +247,50 @@ def soft_argmax_rescaled(heatmaps):
     return tf.concat([locations, maxes[..., tf.newaxis]], axis=2)
 
 
-def gaussian_blur(img, kernel_size=13, sigma=7):
-    def gauss_kernel(channels, kernel_size: int, sigma):
-        ax = tf.range(-kernel_size // 2 + 1.0, kernel_size // 2 + 1.0)
-        xx, yy = tf.meshgrid(ax, ax)
-        kernel = tf.exp(-(xx ** 2 + yy ** 2) / (2.0 * sigma ** 2))
-        kernel = kernel / tf.reduce_sum(kernel)
-        kernel = tf.tile(kernel[..., tf.newaxis], [1, 1, channels])
-        return kernel
-
-    gaussian_kernel = gauss_kernel(tf.shape(img)[-1], kernel_size, sigma)
-    gaussian_kernel = gaussian_kernel[..., tf.newaxis]
-
-    return tf.nn.depthwise_conv2d_native(img, gaussian_kernel, [1, 1, 1, 1],
+def gaussian_kernel_1d(kernel_size: int, sigma):
+    """ Normalised 1-D Gaussian kernel. Its outer product with itself is the
+    normalised 2-D kernel """
+    ax = np.arange(kernel_size) - (kernel_size - 1) / 2
+    kernel = np.exp(-ax ** 2 / (2.0 * sigma ** 2))
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def gaussian_blur(img, kernel_size=13, sigma=7, downsample=1):
+    """ Per-channel Gaussian blur of NHWC images, as a vertical then a
+    horizontal depthwise convolution with constant 1-D kernels (2k rather
+    than k^2 multiply-adds per pixel, with the same result as the 2-D kernel
+    including at the zero padded borders). downsample > 1 blurs at that
+    fraction of the resolution (average pooled, with sigma and kernel_size
+    scaled down) and resizes back, which is cheaper but only approximate """
+    if downsample > 1:
+        size = tf.shape(img)[1:3]
+        small = tf.nn.avg_pool(img, [1, downsample, downsample, 1],
+                               [1, downsample, downsample, 1], 'SAME')
+        small_kernel_size = max(kernel_size // downsample, 1) | 1  # odd
+        blurred = gaussian_blur(small, small_kernel_size, sigma / downsample)
+        return tf.image.resize_bilinear(blurred, size, align_corners=True)
+
+    kernel = gaussian_kernel_1d(kernel_size, sigma)
+    channels = img.shape[-1].value
+    if channels is not None:
+        kernel = tf.constant(np.tile(kernel[:, np.newaxis], [1, channels]))
+    else:
+        kernel = tf.tile(tf.constant(kernel)[:, tf.newaxis],
+                         [1, tf.shape(img)[-1]])
+    kernel = tf.cast(kernel, img.dtype)
+    # [k, 1, channels, 1] and [1, k, channels, 1] filters
+    kernel_v = kernel[:, tf.newaxis, :, tf.newaxis]
+    kernel_h = kernel[tf.newaxis, :, :, tf.newaxis]
+    blurred = tf.nn.depthwise_conv2d_native(img, kernel_v, [1, 1, 1, 1],
+                                            padding='SAME',
+                                            data_format='NHWC')
+    return tf.nn.depthwise_conv2d_native(blurred, kernel_h, [1, 1, 1, 1],
                                          padding='SAME', data_format='NHWC')
+
+
+def normalize_minmax(images):
+    # Per-image equivalent of cv2.normalize(img, None, 0, 1, cv2.NORM_MINMAX)
+    mins = tf.reduce_min(images, axis=[1, 2, 3], keepdims=True)
+    ranges = tf.reduce_max(images, axis=[1, 2, 3], keepdims=True) - mins
+    scale = tf.where(ranges > 0, tf.reciprocal(ranges), tf.zeros_like(ranges))
+    return (images - mins) * scale
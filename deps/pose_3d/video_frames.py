@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import cv2
+
+
+class VideoFrames:
+    """ Decodes the frames of a video sequentially as RGB. Decoding reuses
+    the same buffers, so the frame yielded by iteration is only valid until
+    the next frame is decoded - copy it to keep it. """
+    def __init__(self, video_file):
+        self.video_file = video_file
+        self.cap = cv2.VideoCapture(video_file)
+        if not self.cap.isOpened():
+            raise OSError("Could not open video {}".format(video_file))
+        self._bgr = None
+        self._rgb = None
+
+    def __len__(self):
+        # Frame count from the container - can be off for some videos
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def __iter__(self):
+        while True:
+            ok, self._bgr = self.cap.read(self._bgr)
+            if not ok:
+                return
+            self._rgb = cv2.cvtColor(self._bgr, cv2.COLOR_BGR2RGB,
+                                     dst=self._rgb)
+            yield self._rgb
+
+    def skip(self):
+        # Advance one frame without converting it
+        return self.cap.grab()
+
+    def close(self):
+        self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_video_frames(video_file, frame_indices=None):
+    """ Read frames of a video as a uint8 array of shape (time, h, w, 3) in
+    RGB. If frame_indices (ascending) is given, only those frames are
+    converted and stored; the frames in between are skipped """
+    video = VideoFrames(video_file)
+    try:
+        if frame_indices is None:
+            frames = np.array([ frame.copy() for frame in video ],
+                              dtype=np.uint8)
+            return frames
+
+        frames = None
+        frames_iter = iter(video)
+        pos = 0
+        for out_idx, frame_idx in enumerate(frame_indices):
+            while pos < frame_idx:
+                video.skip()
+                pos += 1
+            frame = next(frames_iter, None)
+            if frame is None:
+                raise OSError("Frame {} not in video {}".format(
+                    frame_idx, video_file))
+            pos += 1
+            if frames is None:
+                frames = np.empty((len(frame_indices),) + frame.shape,
+                                  dtype=np.uint8)
+            frames[out_idx] = frame
+        if frames is None:
+            return np.zeros((0, 0, 0, 3), dtype=np.uint8)
+        return frames
+    finally:
+        video.close()